@@ -1,5 +1,10 @@
 from database import Network
 from math import exp
+import multiprocessing
+import numpy
+import random
+from snapshot import read_snapshot, write_snapshot
+import time
 
 
 class Adversary:
@@ -7,55 +12,317 @@ class Adversary:
 
     :param curator: curator of the target network
     :param float eta: multiplicative weights update power (w <-- w * e^eta)
+    :param str storage: link storage mode of the approximation network
+    :param bool counting: pirate in batches by counting seen links (dense storage only)
+    :param int batch_size: number of queries per batch when counting
+    :param str preference_order: 'round-robin' to pirate preference tuples in
+        order, or 'random' to pirate uniformly random preference tuples
     :ivar curator: curator of the target network
     :ivar float eta: multiplicative weights update power (w <-- w * e^eta)
     :ivar network: the approximation network
-    :ivar tuple preference_combinations: all possible preference tuples
-    :ivar int preference_index: index of next preference tuple to pirate
+    :ivar preference_combinations: lazy PreferenceSpace of all possible preference tuples
+    :ivar int preference_index: index of next preference tuple to pirate in round-robin order
+    :ivar str preference_order: 'round-robin' or 'random'
+    :ivar counts: times each link was seen by source, destination, and response (counting only)
+    :ivar int batch_size: number of queries per batch when counting
+    :ivar int queries_pirated: total number of queries pirated so far
+    :ivar str checkpoint_path: file to checkpoint to while pirating, if any
+    :ivar int checkpoint_queries: checkpoint after this many queries, if set
+    :ivar float checkpoint_seconds: checkpoint after this many seconds, if set
     """
 
-    def __init__(self, curator, eta=1e-4):
+    def __init__(self, curator, eta=1e-4, storage='object', counting=False, batch_size=10000,
+                 preference_order='round-robin'):
+        if counting and storage != 'dense':
+            raise ValueError('Counting adversaries need dense storage')
         self.curator = curator
         self.eta = eta
         self.network = Network(size=self.curator.network.size,
-                               interactivity=self.curator.network.interactivity)
+                               interactivity=self.curator.network.interactivity,
+                               storage=storage)
         self.network.make_all_links()
         self.preference_combinations = self.network.get_all_preferences()
         self.preference_index = 0
+        self.preference_order = preference_order
+        self.counts = None
+        self.batch_size = batch_size
+        if counting:
+            self.counts = numpy.zeros(self.network.utilities.shape, dtype=numpy.int64)
+        self.queries_pirated = 0
+        self.checkpoint_path = None
+        self.checkpoint_queries = None
+        self.checkpoint_seconds = None
+        self._last_checkpoint = (0, time.time())
 
     @staticmethod
     def normalize(utilities):
         utility_sum = sum(utilities)
         return [1.0 * utility / utility_sum for utility in utilities]
 
+    @staticmethod
+    def log_normalize(utilities):
+        """Return the logs of the utilities normalized to probabilities
+
+        Zero utilities have log-probability -inf.
+        """
+        with numpy.errstate(divide='ignore'):
+            log_utilities = numpy.log(numpy.asarray(utilities, dtype=float))
+        return list(log_utilities - numpy.log(numpy.sum(utilities)))
+
     def pirate(self, sequence_length, number_of_queries=1):
         """Return a network that approximates curator's network probabilities
 
         This network's link utilities are normalized to probabilities, rather
         than fed through the exponential mechanism to obtain probabilities.
 
+        Counting adversaries query in batches and add up how often each link
+        is seen. Multiplicative weights commute, so every utility is then set
+        to e^(eta * count) at once.
+
         :param int sequence_length: length of sequences to pirate
         :param int number_of_queries: number of times to query the curator
         """
+        if self.counts is not None:
+            self.pirate_counts(sequence_length, number_of_queries)
+            return
         progress_bar_size = 50
         progress_bar_step = 2
         print 'Pirating %d' % number_of_queries, '|' + ' ' * progress_bar_size + '|',
+        preferences_stream = self.preference_combinations.iterate(self.preference_index, self.preference_order)
         for query_number in range(number_of_queries):
             if not query_number % (number_of_queries * progress_bar_step / 100.0) and query_number:
                 progress_percent = int(100 * query_number / number_of_queries)
                 print('\rPirating %d\t|' % number_of_queries +
                       '-' * (progress_percent * progress_bar_size / 100) +
                       ' ' * ((100 - progress_percent) * progress_bar_size / 100) + '|'),
-            preferences = self.preference_combinations[self.preference_index]
-            query_response = self.curator.query(sequence_length, preferences)
-            sequence = [node for node in self.network.nodes for name in query_response
-                        if node.name == name]
+            preferences = next(preferences_stream)
+            sequence = self.curator.query(sequence_length, preferences, ids=True)
             # Update all seen links by multiplicative weights
-            for i in range(len(sequence) - 1):
-                node1, node2 = sequence[i], sequence[i + 1]
-                preference = preferences[self.network.nodes.index(node1)]
-                link = node1.links[node2][preference]
-                link.utility *= exp(self.eta)
+            for index1, index2 in zip(sequence[:-1], sequence[1:]):
+                self.network.multiply_utility(index1, index2, preferences[index1], exp(self.eta))
             self.preference_index += 1
-            self.preference_index %= len(self.preference_combinations)
+            self.preference_index %= self.preference_combinations.count
+            self.queries_pirated += 1
+            self.maybe_checkpoint()
         print '\rPirating %d\t|' % number_of_queries + '-' * progress_bar_size + '|'
+
+    def pirate_counts(self, sequence_length, number_of_queries=1):
+        """Pirate in batches of self.batch_size queries by counting seen links
+
+        :param int sequence_length: length of sequences to pirate
+        :param int number_of_queries: number of times to query the curator
+        """
+        print 'Pirating %d' % number_of_queries,
+        dirty_rows = numpy.zeros(self.network.size * self.network.interactivity, dtype=bool)
+        for batch_start in range(0, number_of_queries, self.batch_size):
+            batch_count = min(self.batch_size, number_of_queries - batch_start)
+            counts, batch_dirty_rows = count_links(self.curator, self.preference_combinations,
+                                                   self.preference_index, batch_count, sequence_length,
+                                                   order=self.preference_order)
+            self.counts += counts
+            dirty_rows |= batch_dirty_rows
+            self.preference_index += batch_count
+            self.preference_index %= self.preference_combinations.count
+            self.queries_pirated += batch_count
+            self.maybe_checkpoint()
+        self.apply_counts(dirty_rows)
+        print '\tdone'
+
+    def pirate_parallel(self, sequence_length, number_of_queries=1, processes=None, seed=None):
+        """Pirate in batches of self.batch_size queries spread over a process pool
+
+        Every worker holds its own copy of the curator. The i-th batch draws
+        from its own RandomState seeded with (seed, i), so results only depend
+        on ``seed`` and self.batch_size, not on the number of processes. The
+        workers return link counts, which are merged into self.counts. A
+        curator network loaded read-only with Network.load reaches the workers
+        as just its snapshot path, and every worker maps the same file.
+
+        :param int sequence_length: length of sequences to pirate
+        :param int number_of_queries: number of times to query the curator
+        :param int processes: number of worker processes (default: number of CPUs)
+        :param int seed: seed of the batch random streams (default: random)
+        """
+        if self.counts is None:
+            raise ValueError('Parallel pirating needs a counting adversary')
+        if seed is None:
+            seed = numpy.random.randint(2 ** 31)
+        print 'Pirating %d in parallel' % number_of_queries,
+        batches = []
+        for batch_number, batch_start in enumerate(range(0, number_of_queries, self.batch_size)):
+            batch_count = min(self.batch_size, number_of_queries - batch_start)
+            batches.append(((self.preference_index + batch_start) % self.preference_combinations.count,
+                            batch_count, sequence_length, (seed, batch_number), self.preference_order))
+        pool = multiprocessing.Pool(processes, initializer=_initialize_worker,
+                                    initargs=(self.curator, self.preference_combinations))
+        try:
+            results = pool.map(_count_batch, batches)
+        finally:
+            pool.close()
+            pool.join()
+        dirty_rows = numpy.zeros(self.network.size * self.network.interactivity, dtype=bool)
+        for counts, batch_dirty_rows in results:
+            self.counts += counts
+            dirty_rows |= batch_dirty_rows
+        self.preference_index += number_of_queries
+        self.preference_index %= self.preference_combinations.count
+        self.queries_pirated += number_of_queries
+        self.apply_counts(dirty_rows)
+        self.maybe_checkpoint()
+        print '\tdone'
+
+    def enable_checkpoints(self, path, queries=None, seconds=None):
+        """Checkpoint to ``path`` while pirating, every so many queries or seconds
+
+        Serial pirating can checkpoint after any query, counting adversaries
+        after any batch, and parallel pirating after every call.
+
+        :param str path: checkpoint file path
+        :param int queries: checkpoint after this many queries since the last checkpoint
+        :param float seconds: checkpoint after this many seconds since the last checkpoint
+        """
+        self.checkpoint_path = path
+        self.checkpoint_queries = queries
+        self.checkpoint_seconds = seconds
+        self._last_checkpoint = (self.queries_pirated, time.time())
+
+    def maybe_checkpoint(self):
+        """Checkpoint if a checkpoint interval has passed
+        """
+        if self.checkpoint_path is None:
+            return
+        last_queries, last_time = self._last_checkpoint
+        if ((self.checkpoint_queries is not None and
+             self.queries_pirated - last_queries >= self.checkpoint_queries) or
+                (self.checkpoint_seconds is not None and time.time() - last_time >= self.checkpoint_seconds)):
+            self.checkpoint(self.checkpoint_path)
+
+    def checkpoint(self, path):
+        """Save the pirating state and the random states to a snapshot file
+
+        The checkpoint holds the approximation network's link utilities, the
+        link counts of counting adversaries, the preference position, eta,
+        and the states of the random and numpy.random generators, so a resumed
+        adversary continues exactly as this one would.
+
+        :param str path: checkpoint file path
+        """
+        python_random_version, python_random_words, python_random_gauss = random.getstate()
+        _, numpy_random_keys, numpy_random_position, numpy_has_gauss, numpy_cached_gaussian = \
+            numpy.random.get_state()
+        utilities, defined = self.network.utility_arrays()
+        header = {'format': 'adversary', 'version': 1, 'eta': self.eta,
+                  'storage': self.network.storage, 'counting': self.counts is not None,
+                  'batch_size': self.batch_size, 'preference_order': self.preference_order,
+                  'preference_index': str(self.preference_index), 'queries_pirated': self.queries_pirated,
+                  'python_random_version': python_random_version, 'python_random_gauss': python_random_gauss,
+                  'numpy_random_position': numpy_random_position, 'numpy_has_gauss': numpy_has_gauss,
+                  'numpy_cached_gaussian': numpy_cached_gaussian}
+        arrays = {'utilities': utilities, 'defined': defined,
+                  'python_random_words': numpy.array(python_random_words, dtype=numpy.uint32),
+                  'numpy_random_keys': numpy_random_keys}
+        if self.counts is not None:
+            arrays['counts'] = self.counts
+        write_snapshot(path, header, arrays)
+        self._last_checkpoint = (self.queries_pirated, time.time())
+
+    @classmethod
+    def resume(cls, path, curator):
+        """Return an adversary restored from a checkpoint, and restore the random states
+
+        :param str path: checkpoint file path
+        :param curator: curator of the target network
+        :return: restored Adversary
+        """
+        header, arrays = read_snapshot(path, mmap_mode=None)
+        adversary = cls(curator, eta=header['eta'], storage=str(header['storage']),
+                        counting=header['counting'], batch_size=header['batch_size'],
+                        preference_order=str(header['preference_order']))
+        adversary.preference_index = int(header['preference_index'])
+        adversary.queries_pirated = header['queries_pirated']
+        if adversary.counts is not None:
+            adversary.counts[...] = arrays['counts']
+            adversary.apply_counts()
+        elif adversary.network.storage == 'dense':
+            adversary.network.utilities[...] = arrays['utilities']
+            adversary.network.touch_all()
+        else:
+            for source_index, destination_index, response in zip(*numpy.nonzero(arrays['defined'])):
+                adversary.network.set_utility(source_index, destination_index, response,
+                                              float(arrays['utilities'][source_index, destination_index, response]))
+        random.setstate((header['python_random_version'],
+                         tuple(int(word) for word in arrays['python_random_words']),
+                         header['python_random_gauss']))
+        numpy.random.set_state(('MT19937', arrays['numpy_random_keys'], header['numpy_random_position'],
+                                header['numpy_has_gauss'], header['numpy_cached_gaussian']))
+        adversary._last_checkpoint = (adversary.queries_pirated, time.time())
+        return adversary
+
+    def apply_counts(self, dirty_rows=None):
+        """Set every link utility to e^(eta * count) from self.counts
+
+        Multiplicative weights commute and every link starts at utility 1, so
+        this equals applying each seen link's update one at a time.
+
+        :param dirty_rows: mask of (node * interactivity + response) rows to mark as changed
+        """
+        interactivity = self.network.interactivity
+        self.network.utilities[...] = numpy.exp(self.eta * self.counts)
+        if dirty_rows is None:
+            self.network.touch_all()
+            return
+        for row in numpy.flatnonzero(dirty_rows):
+            self.network.nodes[row // interactivity].touch(row % interactivity)
+
+
+def count_links(curator, preference_combinations, preference_index, count, sequence_length,
+                random_state=None, order='round-robin'):
+    """Return link counts and seen rows of a batch of curator queries
+
+    In round-robin order the batch cycles through ``preference_combinations``
+    from ``preference_index``, and in random order it draws random tuples.
+
+    :param curator: curator of the target network
+    :param preference_combinations: PreferenceSpace of all possible preference tuples
+    :param int preference_index: index of the first preference tuple of the batch
+    :param int count: number of queries in the batch
+    :param int sequence_length: length of sequences to query
+    :param random_state: numpy RandomState to draw from (default: numpy.random)
+    :param str order: 'round-robin' or 'random'
+    :return: (size, size, interactivity) link counts and mask of seen
+        (node * interactivity + response) rows
+    :rtype: tuple
+    """
+    size, interactivity = curator.network.size, curator.network.interactivity
+    if order == 'random':
+        preferences_batch = preference_combinations.random_batch(count, random_state)
+    else:
+        preferences_batch = preference_combinations.batch(preference_index, count)
+    sequences = curator.query_batch(sequence_length, preferences_batch, count, random_state)
+    sources, destinations = sequences[:, :-1], sequences[:, 1:]
+    responses = preferences_batch[numpy.arange(count)[:, numpy.newaxis], sources]
+    counts = numpy.bincount(((sources * size + destinations) * interactivity + responses).ravel(),
+                            minlength=size * size * interactivity).reshape(size, size, interactivity)
+    dirty_rows = numpy.zeros(size * interactivity, dtype=bool)
+    dirty_rows[(sources * interactivity + responses).ravel()] = True
+    return counts, dirty_rows
+
+
+_worker_curator = None
+_worker_preference_combinations = None
+
+
+def _initialize_worker(curator, preference_combinations):
+    """Keep a pool worker's own copy of the curator and preference tuples
+    """
+    global _worker_curator, _worker_preference_combinations
+    _worker_curator = curator
+    _worker_preference_combinations = preference_combinations
+
+
+def _count_batch(batch):
+    """Return link counts and seen rows of one pool worker batch
+    """
+    preference_index, count, sequence_length, seed, order = batch
+    return count_links(_worker_curator, _worker_preference_combinations, preference_index, count,
+                       sequence_length, numpy.random.RandomState(seed), order)
@@ -0,0 +1,229 @@
+"""Benchmarks of the content network privacy model's hot paths
+
+Every benchmark runs once per cell of a parameter grid, each in a fresh
+worker process so its peak memory is its own. Throughput and peak memory are
+written to a JSON file, and can be compared against a stored baseline, in
+which case the exit status is 1 if any benchmark regressed.
+
+Example::
+
+    python benchmarks.py baseline.json
+    python benchmarks.py current.json --baseline baseline.json --tolerance 0.2
+"""
+from adversary import Adversary
+import argparse
+from curator import Curator
+from database import Network
+from itertools import product
+import json
+import multiprocessing
+import numpy
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+DEFAULT_GRID = {
+    'size': [10, 30],
+    'interactivity': [2],
+    'density': [0.1, 0.5],
+    'sequence_length': [3, 4],
+}
+QUERIES = 1000
+ROWS = 10000
+# Fast benchmarks repeat until they take this long, so timer noise stays small
+MINIMUM_SECONDS = 0.1
+
+
+def benchmark_make_random_links(case):
+    def make_random_links():
+        Network(case['size'], case['interactivity'], case['storage']).make_random_links(density=case['density'])
+    repeats, seconds = _repeat(make_random_links)
+    return repeats * case['size'] ** 2 * case['interactivity'], seconds, 'links/s'
+
+
+def benchmark_sequence_probabilities(case):
+    curator = _curator(case)
+    preferences = curator.network.get_random_preferences()
+    repeats, seconds = _repeat(lambda: curator.network.sequence_probabilities(preferences, case['sequence_length'],
+                                                                              curator.exponential_mechanism))
+    return repeats * case['size'] ** case['sequence_length'], seconds, 'sequences/s'
+
+
+def benchmark_query(case):
+    curator = _curator(case)
+    preferences = [curator.network.get_random_preferences() for _ in range(QUERIES)]
+    start = time.time()
+    for query_preferences in preferences:
+        curator.query(case['sequence_length'], query_preferences)
+    return QUERIES, time.time() - start, 'queries/s'
+
+
+def benchmark_exponential_mechanism(case):
+    curator = _curator(case)
+    rows = numpy.random.random_sample((ROWS, case['size']))
+    rows[numpy.random.random_sample(rows.shape) > case['density']] = 0
+    rows[:, 0] = 1
+    start = time.time()
+    for utilities in rows:
+        curator.exponential_mechanism(utilities)
+    return ROWS, time.time() - start, 'rows/s'
+
+
+def benchmark_pirate(case):
+    curator = _curator(case)
+    adversary = Adversary(curator, storage=case['storage'])
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        start = time.time()
+        adversary.pirate(case['sequence_length'], number_of_queries=QUERIES)
+        seconds = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return QUERIES, seconds, 'queries/s'
+
+
+BENCHMARKS = {
+    'make_random_links': benchmark_make_random_links,
+    'sequence_probabilities': benchmark_sequence_probabilities,
+    'query': benchmark_query,
+    'exponential_mechanism': benchmark_exponential_mechanism,
+    'pirate': benchmark_pirate,
+}
+
+
+def _curator(case):
+    curator = Curator()
+    curator.network = Network(case['size'], case['interactivity'], case['storage'])
+    curator.network.make_random_links(density=case['density'])
+    return curator
+
+
+def _repeat(function):
+    """Call a function until MINIMUM_SECONDS have passed and return the calls and seconds taken
+    """
+    repeats = 0
+    start = time.time()
+    while not repeats or time.time() - start < MINIMUM_SECONDS:
+        function()
+        repeats += 1
+    return repeats, time.time() - start
+
+
+def _run_case(case):
+    """Run one benchmark case in a worker process
+    """
+    random.seed(case['seed'])
+    numpy.random.seed(case['seed'])
+    memory_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    operations, seconds, unit = BENCHMARKS[case['benchmark']](case)
+    result = dict(case)
+    result.update({
+        'operations': operations,
+        'seconds': seconds,
+        'throughput': operations / max(seconds, 1e-9),
+        'unit': unit,
+        'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_memory_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory_before,
+    })
+    return result
+
+
+def run_benchmarks(grid, benchmarks=None, storage='object', seed=0):
+    """Run benchmarks over every cell of a parameter grid, one worker process per case
+
+    :param dict grid: size, interactivity, density, and sequence_length keying to lists of values
+    :param list benchmarks: names of benchmarks to run (default: all of BENCHMARKS)
+    :param str storage: Network storage mode
+    :param int seed: seed of the random and numpy.random generators in every case
+    :return: list of result dicts
+    :rtype: list
+    """
+    names = sorted(grid)
+    results = []
+    for benchmark in benchmarks or sorted(BENCHMARKS):
+        for values in product(*[grid[name] for name in names]):
+            case = dict(zip(names, values), benchmark=benchmark, storage=storage, seed=seed)
+            pool = multiprocessing.Pool(1)
+            try:
+                result = pool.apply(_run_case, (case,))
+            finally:
+                pool.close()
+                pool.join()
+            print '%s %s: %.4g %s, %d KB peak' % (benchmark, _describe(case), result['throughput'],
+                                                  result['unit'], result['peak_memory_kb'])
+            results.append(result)
+    return results
+
+
+def case_key(result):
+    """Return the benchmark name and parameters identifying a result
+
+    :param dict result: result dict
+    :rtype: tuple
+    """
+    return (result['benchmark'], result['storage'], result['size'], result['interactivity'],
+            result['density'], result['sequence_length'])
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Return the regressions of results against baseline results
+
+    A result regressed if its throughput fell below (1 - tolerance) times the
+    baseline's, or its peak memory growth rose above (1 + tolerance) times the
+    baseline's (or 1 MB, if larger). Results without a baseline are skipped.
+
+    :param list results: result dicts
+    :param list baseline: baseline result dicts
+    :param float tolerance: allowed fractional change
+    :return: list of messages describing regressions
+    :rtype: list
+    """
+    baseline = {case_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline.get(case_key(result))
+        if old is None:
+            continue
+        if result['throughput'] < (1 - tolerance) * old['throughput']:
+            regressions.append('%s %s: throughput %.4g %s, baseline %.4g' %
+                               (result['benchmark'], _describe(result), result['throughput'],
+                                result['unit'], old['throughput']))
+        if result['peak_memory_growth_kb'] > (1 + tolerance) * max(old['peak_memory_growth_kb'], 1024):
+            regressions.append('%s %s: peak memory growth %d KB, baseline %d KB' %
+                               (result['benchmark'], _describe(result), result['peak_memory_growth_kb'],
+                                old['peak_memory_growth_kb']))
+    return regressions
+
+
+def _describe(case):
+    return 'size=%d interactivity=%d density=%.3g sequence_length=%d' % (
+        case['size'], case['interactivity'], case['density'], case['sequence_length'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the privacy model')
+    parser.add_argument('path', help='results JSON file')
+    parser.add_argument('--baseline', help='baseline results JSON file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed fractional regression')
+    parser.add_argument('--benchmarks', nargs='*', choices=sorted(BENCHMARKS), help='benchmarks to run')
+    parser.add_argument('--storage', default='object', choices=('object', 'dense', 'sparse'))
+    parser.add_argument('--seed', type=int, default=0, help='seed of every case')
+    for name in sorted(DEFAULT_GRID):
+        parser.add_argument('--' + name.replace('_', '-'), nargs='*', type=float if name == 'density' else int,
+                            default=DEFAULT_GRID[name], help='%s values' % name)
+    arguments = parser.parse_args()
+    grid = {name: getattr(arguments, name) for name in DEFAULT_GRID}
+    results = run_benchmarks(grid, arguments.benchmarks, arguments.storage, arguments.seed)
+    with open(arguments.path, 'w') as results_file:
+        json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                   'numpy': numpy.__version__, 'results': results}, results_file, indent=2, sort_keys=True)
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file)['results'], arguments.tolerance)
+        for regression in regressions:
+            print 'Regression: ' + regression
+        sys.exit(1 if regressions else 0)
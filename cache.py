@@ -0,0 +1,130 @@
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+
+
+class ResultCache:
+    """Content-addressed cache of Network sequence results
+
+    Results are keyed by the Network's content hash, the preference tuple,
+    the sequence length, the probability conversion function, and epsilon, so
+    unchanged networks reuse results within and across runs. The in-memory
+    tier evicts least recently used results, and the optional on-disk tier
+    keeps one pickle file per result.
+
+    :param int max_entries: maximum number of results kept in memory
+    :param str directory: directory of the on-disk tier, if any
+    :ivar int max_entries: maximum number of results kept in memory
+    :ivar str directory: directory of the on-disk tier, if any
+    :ivar int hits: number of results found in memory
+    :ivar int disk_hits: number of results found on disk
+    :ivar int misses: number of results computed
+    """
+
+    def __init__(self, max_entries=256, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def sequence_probabilities(self, network, preferences, sequence_length, probability_conversion, epsilon=None):
+        """Return network.sequence_probabilities(...), from the cache if possible
+
+        :param network: Network
+        :param tuple preferences: user input at each node
+        :param int sequence_length: length of sequences
+        :param probability_conversion: function converting utilities to probabilities
+        :param float epsilon: privacy parameter (default: the conversion's curator epsilon)
+        :return: list of probabilities for every possible sequence
+        :rtype: list
+        """
+        key = self.key('sequence_probabilities', network, preferences, sequence_length,
+                       probability_conversion, epsilon)
+        return self.lookup(key, lambda: network.sequence_probabilities(preferences, sequence_length,
+                                                                       probability_conversion))
+
+    def top_sequences(self, network, preferences, sequence_length, k, probability_conversion, epsilon=None):
+        """Return network.top_sequences(...), from the cache if possible
+
+        :param network: Network
+        :param tuple preferences: user input at each node
+        :param int sequence_length: length of sequences
+        :param int k: number of sequences
+        :param probability_conversion: function converting utilities to probabilities
+        :param float epsilon: privacy parameter (default: the conversion's curator epsilon)
+        :return: list of (tuple of node indices, probability) pairs
+        :rtype: list
+        """
+        key = self.key('top_sequences', network, preferences, sequence_length,
+                       probability_conversion, epsilon) + (k,)
+        return self.lookup(key, lambda: network.top_sequences(preferences, sequence_length, k,
+                                                              probability_conversion))
+
+    @staticmethod
+    def key(kind, network, preferences, sequence_length, probability_conversion, epsilon=None):
+        """Return the cache key of a Network sequence result
+
+        Bound methods are named by class and method, and their object's
+        epsilon, if it has one, is used when ``epsilon`` is not given.
+
+        :rtype: tuple
+        """
+        owner = getattr(probability_conversion, '__self__', None)
+        if epsilon is None:
+            epsilon = getattr(owner, 'epsilon', None)
+        if owner is not None:
+            conversion_name = owner.__class__.__name__ + '.' + probability_conversion.__name__
+        else:
+            conversion_name = (getattr(probability_conversion, '__module__', '') + '.' +
+                               probability_conversion.__name__)
+        return (kind, network.content_hash(), tuple(int(preference) for preference in preferences),
+                sequence_length, conversion_name, epsilon)
+
+    def lookup(self, key, compute):
+        """Return the result of ``key``, calling ``compute()`` only if it is not cached
+
+        :param tuple key: cache key
+        :param compute: function computing the result
+        """
+        if key in self._results:
+            self.hits += 1
+            result = self._results.pop(key)
+        else:
+            result = self._load(key)
+            if result is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                result = compute()
+                self._store(key, result)
+        self._results[key] = result
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        return result
+
+    def clear(self):
+        """Drop the in-memory tier
+        """
+        self._results.clear()
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.pickle')
+
+    def _load(self, key):
+        if self.directory is None or not os.path.exists(self._path(key)):
+            return None
+        with open(self._path(key), 'rb') as result_file:
+            return pickle.load(result_file)
+
+    def _store(self, key, result):
+        if self.directory is None:
+            return
+        temporary_path = self._path(key) + '.tmp'
+        with open(temporary_path, 'wb') as result_file:
+            pickle.dump(result, result_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary_path, self._path(key))
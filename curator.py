@@ -1,59 +1,351 @@
+from collections import OrderedDict
 from itertools import product
 import numpy
 import random
+from sampling import AliasTable, stacked_alias_tables
+
+
+def log_sum_exp(values):
+    """Return log(sum(exp(values))) without overflow or underflow
+
+    :param values: array of log-space values
+    :return: log of the sum of the exponentiated values
+    :rtype: float
+    """
+    values = numpy.asarray(values, dtype=float)
+    if not len(values):
+        return -numpy.inf
+    maximum = values.max()
+    if not numpy.isfinite(maximum):
+        return maximum
+    return maximum + numpy.log(numpy.exp(values - maximum).sum())
 
 
 class Curator:
     """Database curator that creates and queries databases for analysts
 
+    Step probabilities are cached per (node, response) row, in least
+    recently used order. A cached row is recomputed when the Links leaving its
+    node change (see Node.touch), when epsilon changes, or when the network is
+    replaced. The stacked alias tables of dense batch queries and the
+    cumulative link weights of sparse batch queries are cached the same way,
+    for the whole network at once.
+
     :param float epsilon: privacy parameter
+    :param int cache_size: maximum number of cached step probability rows
     :ivar float epsilon: privacy parameter
     :ivar database: private content network
+    :ivar int cache_size: maximum number of cached step probability rows
+    :ivar int cache_hits: number of step probability rows served from the cache
+    :ivar int cache_misses: number of step probability rows computed
     """
 
-    def __init__(self, epsilon=100):
+    def __init__(self, epsilon=100, cache_size=4096):
         self.epsilon = epsilon
         self.network = None
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = OrderedDict()
+        self._cache_network = None
+        self._alias_tables_cache = None
+        self._sparse_batch_cache = None
+
+    def __getstate__(self):
+        # The sparse batch step is a closure, and is cheap to rebuild
+        state = self.__dict__.copy()
+        state['_sparse_batch_cache'] = None
+        return state
 
-    def exponential_mechanism(self, utilities):
+    def exponential_mechanism(self, utilities, log=False):
         """Return a list of probabilities generated from the utilities
 
+        The weights exp(epsilon * utility / 2) are normalized in log space, so
+        large epsilons or utilities neither overflow nor underflow.
+
+        :param bool log: return log-probabilities instead of probabilities
         :return: list of probabilities generated from the utilities
         :rtype: list
         """
-        weights = numpy.exp(0.5 * self.epsilon * numpy.array(utilities))
-        return list(weights / sum(weights))
+        log_weights = 0.5 * self.epsilon * numpy.asarray(utilities, dtype=float)
+        log_probabilities = log_weights - log_sum_exp(log_weights)
+        if log:
+            return list(log_probabilities)
+        return list(numpy.exp(log_probabilities))
+
+    def log_exponential_mechanism(self, utilities):
+        """Return a list of log-probabilities generated from the utilities
+
+        :return: list of log-probabilities generated from the utilities
+        :rtype: list
+        """
+        return self.exponential_mechanism(utilities, log=True)
+
+    def invalidate(self, node_index=None, response=None):
+        """Drop cached step probability rows
+
+        Without arguments the whole cache is dropped. Call this after writing
+        to a network's link arrays without Node.touch.
+
+        :param int node_index: only drop rows of this node
+        :param int response: only drop rows for this user input
+        """
+        self._alias_tables_cache = None
+        self._sparse_batch_cache = None
+        if node_index is None and response is None:
+            self._cache.clear()
+            return
+        for key in list(self._cache):
+            if node_index in (None, key[0]) and response in (None, key[1]):
+                del self._cache[key]
+
+    def step_probabilities(self, node_index, response):
+        """Return the step probabilities from a node given a user input
+
+        :param int node_index: index of the source node in self.network.nodes
+        :param int response: user input at the source node
+        :return: array of step probabilities and an AliasTable sampling them
+        :rtype: tuple
+        """
+        if self._cache_network is not self.network:
+            self._cache.clear()
+            self._cache_network = self.network
+        key = (node_index, response)
+        version = (self.network.row_version(node_index, response), self.epsilon)
+        entry = self._cache.pop(key, None)
+        if entry is not None and entry[0] == version:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            utilities = self.network.link_utilities(node_index, response)
+            probabilities = numpy.array(self.exponential_mechanism(utilities))
+            entry = (version, probabilities, AliasTable(probabilities))
+        self._cache[key] = entry
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return entry[1], entry[2]
+
+    def exponential_mechanism_lumped(self, utilities, remainder_count):
+        """Return probabilities for defined links and for the lumped undefined remainder
+
+        The ``remainder_count`` undefined links all have utility 0, so their
+        weights are lumped into a single mass instead of being listed. Like
+        exponential_mechanism, the normalization is done in log space.
+
+        :param utilities: utilities of the defined links
+        :param int remainder_count: number of undefined links
+        :return: array of defined-link probabilities and total remainder probability
+        :rtype: tuple
+        """
+        log_weights = 0.5 * self.epsilon * numpy.asarray(utilities, dtype=float)
+        # Undefined links each have weight exp(0), lumped into one log-weight
+        log_remainder_weight = numpy.log(remainder_count) if remainder_count else -numpy.inf
+        log_total_weight = log_sum_exp(numpy.append(log_weights, log_remainder_weight))
+        return (numpy.exp(log_weights - log_total_weight),
+                numpy.exp(log_remainder_weight - log_total_weight))
+
+    def _sparse_step(self, this_index, preference):
+        """Return the index of a node picked by the lumped exponential mechanism
 
-    def query(self, sequence_length, preferences):
+        Only the defined links of this node are visited. If the lumped
+        remainder is picked, an undefined destination is drawn uniformly.
+        """
+        size = self.network.size
+        destination_indices, utilities = self.network.defined_links(this_index, preference)
+        remainder_count = size - len(destination_indices)
+        probabilities, remainder_probability = self.exponential_mechanism_lumped(utilities, remainder_count)
+        if random.random() >= remainder_probability:
+            return destination_indices[numpy.random.choice(len(probabilities),
+                                                           p=probabilities / probabilities.sum())]
+        if 2 * len(destination_indices) > size:
+            return random.choice(numpy.setdiff1d(numpy.arange(size), destination_indices))
+        while True:
+            candidate = random.randrange(size)
+            position = numpy.searchsorted(destination_indices, candidate)
+            if position == len(destination_indices) or destination_indices[position] != candidate:
+                return candidate
+
+    def query(self, sequence_length, preferences, ids=False):
         """Return a list of nodes picked with the exponential mechanism
 
         Each step in this sequence is picked by running the exponential
-        mechanism on the utilities of links leaving the previous node.
+        mechanism on the utilities of links leaving the previous node, using
+        the cached step probabilities of that node and user input. The next
+        node index is drawn from an alias table in O(1), so nodes with equal
+        probabilities are equally likely without any tie-breaking.
 
         The utility is 0 for any undefined links, but the probability is not.
 
-        The first node is always the first node in self.network.nodes.
+        The first node is picked uniformly from self.network.nodes.
+
+        For sparse networks, each step only visits the defined links leaving
+        the previous node, with the undefined links lumped together.
 
         :param int sequence_length: length of sequence to query
         :param tuple preferences: user input at each node in self.network.nodes
-        :return: list of nodes picked with the exponential mechanism
+        :param bool ids: return node ids instead of node names
+        :return: list of names (or ids) of nodes picked with the exponential mechanism
         :rtype: list
         """
-        sequence = [random.choice(self.network.nodes)]
+        sequence = [random.randrange(self.network.size)]
         for sequence_step in range(sequence_length - 1):
-            this_node = sequence[-1]
-            this_index = self.network.nodes.index(this_node)
-            utilities = [0 if (node not in this_node.links
-                               or preferences[this_index] not in this_node.links[node])
-                         else this_node.links[node][preferences[this_index]].utility
-                         for node in self.network.nodes]
-            probabilities = self.exponential_mechanism(utilities)
-            shuffled_probabilities = probabilities[:]
-            random.shuffle(shuffled_probabilities)
-            next_probability = numpy.random.choice(shuffled_probabilities, p=shuffled_probabilities)
-            # In case of equal probabilities, eliminate earlier-in-list bias
-            next_probability_indices = [i for i, x in enumerate(probabilities) if x == next_probability]
-            next_node_index = random.choice(next_probability_indices)
-            next_node = self.network.nodes[next_node_index]
-            sequence.append(next_node)
-        return [node.name for node in sequence]
+            this_index = sequence[-1]
+            if self.network.storage == 'sparse':
+                next_index = self._sparse_step(this_index, preferences[this_index])
+            else:
+                probabilities, alias_table = self.step_probabilities(this_index, preferences[this_index])
+                next_index = alias_table.sample()
+            sequence.append(int(next_index))
+        if ids:
+            return sequence
+        return [self.network.node_name(node_id) for node_id in sequence]
+
+    def transition_table(self):
+        """Return the exponential-mechanism step probabilities for every node and response
+
+        :return: (size, interactivity, size) array whose [i, r] row holds the
+            step probabilities from the i-th node given user input r
+        :rtype: numpy.ndarray
+        """
+        size, interactivity = self.network.size, self.network.interactivity
+        table = numpy.empty((size, interactivity, size))
+        for node_index in range(size):
+            for response in range(interactivity):
+                table[node_index, response] = self.step_probabilities(node_index, response)[0]
+        return table
+
+    def alias_tables(self):
+        """Return the stacked alias tables of every node and response
+
+        The tables are built together, bypassing the per-row cache, and kept
+        until the network, epsilon, or any Link changes.
+
+        :return: (size * interactivity, size) arrays of acceptance probabilities
+            and aliases, with row i * interactivity + r for the i-th node and user input r
+        :rtype: tuple
+        """
+        size, interactivity = self.network.size, self.network.interactivity
+        # Node.touch only ever increments versions, so their total changes with any Link
+        version = (self.epsilon, sum(sum(node.versions.values()) for node in self.network.nodes))
+        if (self._alias_tables_cache is not None and self._alias_tables_cache[0] is self.network and
+                self._alias_tables_cache[1] == version):
+            return self._alias_tables_cache[2]
+        log_weights = numpy.empty((size * interactivity, size))
+        for node_index in range(size):
+            for response in range(interactivity):
+                log_weights[node_index * interactivity + response] = self.network.link_utilities(
+                    node_index, response)
+        log_weights *= 0.5 * self.epsilon
+        # Shift every row by its maximum before exponentiating, as in log_sum_exp
+        log_weights -= log_weights.max(axis=1)[:, numpy.newaxis]
+        weights = numpy.exp(log_weights)
+        tables = stacked_alias_tables(weights / weights.sum(axis=1)[:, numpy.newaxis])
+        self._alias_tables_cache = (self.network, version, tables)
+        return tables
+
+    def query_batch(self, sequence_length, preferences_batch, count, random_state=None):
+        """Return an array of node index sequences picked with the exponential mechanism
+
+        All ``count`` sequences are sampled in lock-step, with one vectorized
+        alias-table draw per step. The i-th sequence uses the user inputs
+        ``preferences_batch[i % len(preferences_batch)]``.
+
+        :param int sequence_length: length of sequences to query
+        :param preferences_batch: preference tuple, or sequence of preference tuples
+        :param int count: number of sequences to query
+        :param random_state: numpy RandomState to draw from (default: numpy.random)
+        :return: (count, sequence_length) array of node indices
+        :rtype: numpy.ndarray
+        """
+        random_state = numpy.random if random_state is None else random_state
+        preferences_batch = numpy.atleast_2d(numpy.asarray(preferences_batch, dtype=numpy.int64))
+        preference_rows = numpy.arange(count) % len(preferences_batch)
+        if self.network.storage == 'sparse':
+            step = self._sparse_batch_step()
+        else:
+            step = self._dense_batch_step(*self.alias_tables())
+        sequences = numpy.empty((count, sequence_length), dtype=numpy.int64)
+        sequences[:, 0] = random_state.randint(self.network.size, size=count)
+        for sequence_step in range(1, sequence_length):
+            this_indices = sequences[:, sequence_step - 1]
+            responses = preferences_batch[preference_rows, this_indices]
+            sequences[:, sequence_step] = step(this_indices, responses, random_state)
+        return sequences
+
+    def _dense_batch_step(self, acceptances, aliases):
+        """Return a function drawing next node indices from stacked alias tables
+
+        Every sequence picks a uniform column of its row's alias table and
+        keeps it or takes its alias, so each step is O(1) per sequence.
+        """
+        size = acceptances.shape[1]
+        interactivity = self.network.interactivity
+
+        def step(this_indices, responses, random_state):
+            rows = this_indices * interactivity + responses
+            columns = random_state.randint(size, size=len(rows))
+            accepted = random_state.random_sample(len(rows)) < acceptances[rows, columns]
+            return numpy.where(accepted, columns, aliases[rows, columns])
+        return step
+
+    def _sparse_batch_step(self):
+        """Return a function drawing next node indices with the lumped exponential mechanism
+
+        For each response, the row-shifted defined-link weights are
+        accumulated once, up front. Each step then compares the lumped
+        remainder against them, and draws undefined destinations uniformly by
+        vectorized rejection, so a step only indexes into precomputed arrays.
+        """
+        size = self.network.size
+        # Node.touch only ever increments versions, so their total changes with any Link
+        version = (self.epsilon, sum(sum(node.versions.values()) for node in self.network.nodes))
+        if (self._sparse_batch_cache is not None and self._sparse_batch_cache[0] is self.network and
+                self._sparse_batch_cache[1] == version):
+            return self._sparse_batch_cache[2]
+        responses_arrays = []
+        for response in range(self.network.interactivity):
+            indptr = self.network.sparse_indptr[response]
+            indices = self.network.sparse_indices[response]
+            # Weights are scaled by exp(-shift) per row, with shift >= 0, to avoid overflow
+            log_weights = 0.5 * self.epsilon * self.network.sparse_utilities[response]
+            row_lengths = numpy.diff(indptr)
+            shifts = numpy.zeros(size)
+            nonempty_rows = numpy.flatnonzero(row_lengths)
+            if len(nonempty_rows):
+                shifts[nonempty_rows] = numpy.maximum(
+                    numpy.maximum.reduceat(log_weights, indptr[nonempty_rows]), 0)
+            weights = numpy.exp(log_weights - numpy.repeat(shifts, row_lengths))
+            cumulative = numpy.concatenate(([0.0], numpy.cumsum(weights)))
+            keys = numpy.repeat(numpy.arange(size, dtype=numpy.int64), row_lengths) * size + indices
+            responses_arrays.append((indptr, indices, shifts, cumulative, keys))
+
+        def step(this_indices, responses, random_state):
+            next_indices = numpy.empty(len(this_indices), dtype=numpy.int64)
+            for response, (indptr, indices, shifts, cumulative, keys) in enumerate(responses_arrays):
+                walks = numpy.flatnonzero(responses == response)
+                if not len(walks):
+                    continue
+                rows = this_indices[walks]
+                starts, stops = indptr[rows], indptr[rows + 1]
+                defined_weights = cumulative[stops] - cumulative[starts]
+                remainder_weights = (size - (stops - starts)) * numpy.exp(-shifts[rows])
+                targets = random_state.random_sample(len(walks)) * (defined_weights + remainder_weights)
+                defined = targets < defined_weights
+                positions = numpy.searchsorted(cumulative, cumulative[starts[defined]] + targets[defined],
+                                               side='right') - 1
+                positions = numpy.clip(positions, starts[defined], stops[defined] - 1)
+                next_indices[walks[defined]] = indices[positions]
+                # Undefined destinations are uniform over the rest of the row
+                pending = walks[~defined]
+                while len(pending):
+                    candidates = random_state.randint(size, size=len(pending))
+                    candidate_keys = this_indices[pending] * size + candidates
+                    key_positions = numpy.minimum(numpy.searchsorted(keys, candidate_keys),
+                                                  max(len(keys) - 1, 0))
+                    accepted = ((keys[key_positions] != candidate_keys) if len(keys)
+                                else numpy.ones(len(pending), dtype=bool))
+                    next_indices[pending[accepted]] = candidates[accepted]
+                    pending = pending[~accepted]
+            return next_indices
+        self._sparse_batch_cache = (self.network, version, step)
+        return step
@@ -1,27 +1,206 @@
+from collections import Mapping
+import hashlib
 from itertools import product
+import heapq
+import numpy
 import random
+from snapshot import read_snapshot, write_snapshot
 
 
 class Network:
     """Network of Nodes connected by weighted Links
 
+    With ``storage='dense'``, link utilities live in a (size, size,
+    interactivity) utility array and a matching defined-link mask. With
+    ``storage='sparse'``, only defined links are stored, in one compressed-row
+    layout per response. In both array modes each Node's links are a view onto
+    the arrays.
+
     :param int size: number of Nodes
     :param float interactivity: number of user inputs possible at every Node
+    :param str storage: link storage mode, 'object', 'dense', or 'sparse'
     :ivar int size: number of nodes
     :ivar float interactivity: number of user inputs possible at every Node
-    :ivar list nodes: all Nodes
+    :ivar str storage: link storage mode, 'object', 'dense', or 'sparse'
+    :ivar list nodes: all Nodes, each at the index of its id
+    :ivar dict node_ids: Node names keying to Node ids
+    :ivar utilities: link utilities by source, destination, and response (dense only)
+    :ivar defined: defined-link mask by source, destination, and response (dense only)
+    :ivar list sparse_indptr: per-response row offsets into the sparse arrays (sparse only)
+    :ivar list sparse_indices: per-response destination indices, sorted within rows (sparse only)
+    :ivar list sparse_utilities: per-response link utilities (sparse only)
+    :ivar str snapshot_path: snapshot file the link arrays are memory-mapped from, if any
+    :ivar str mmap_mode: numpy.memmap mode of the snapshot arrays, if any
+    :ivar dict snapshot_metadata: metadata saved with the snapshot, if any
     """
 
-    def __init__(self, size=10, interactivity=2):
+    def __init__(self, size=10, interactivity=2, storage='object'):
+        if storage not in ('object', 'dense', 'sparse'):
+            raise ValueError('Unknown storage mode: %r' % storage)
         self.size = size
         self.interactivity = interactivity
+        self.storage = storage
         self.nodes = []
+        self.snapshot_path = None
+        self.mmap_mode = None
+        self.snapshot_metadata = {}
+        self._content_hash = None
+        if self.storage == 'dense':
+            self.utilities = numpy.zeros((size, size, interactivity))
+            self.defined = numpy.zeros((size, size, interactivity), dtype=bool)
+        elif self.storage == 'sparse':
+            self.sparse_indptr = [numpy.zeros(size + 1, dtype=numpy.int64) for _ in range(interactivity)]
+            self.sparse_indices = [numpy.zeros(0, dtype=numpy.int64) for _ in range(interactivity)]
+            self.sparse_utilities = [numpy.zeros(0) for _ in range(interactivity)]
         self.make_nodes()
 
     def make_nodes(self):
         """Make list of self.size Nodes
         """
-        self.nodes = [Node(name='Node' + str(n + 1)) for n in range(self.size)]
+        self.nodes = [Node(name='Node' + str(n + 1), node_id=n) for n in range(self.size)]
+        self.node_ids = dict((node.name, node.id) for node in self.nodes)
+        self._bind_link_views()
+
+    def _bind_link_views(self):
+        """Point the links of every Node at this Network's link arrays
+        """
+        if self.storage != 'object':
+            for index, node in enumerate(self.nodes):
+                node.links = ArrayLinks(self, index)
+
+    def utility_arrays(self):
+        """Return the link utility array and defined-link mask of any storage mode
+
+        :return: (size, size, interactivity) utility array and defined-link mask
+        :rtype: tuple
+        """
+        if self.storage == 'dense':
+            return self.utilities, self.defined
+        shape = (self.size, self.size, self.interactivity)
+        utilities = numpy.zeros(shape)
+        defined = numpy.zeros(shape, dtype=bool)
+        for node_index in range(self.size):
+            for response in range(self.interactivity):
+                destination_indices, defined_utilities = self.defined_links(node_index, response)
+                utilities[node_index, destination_indices, response] = defined_utilities
+                defined[node_index, destination_indices, response] = True
+        return utilities, defined
+
+    def content_hash(self):
+        """Return a SHA-1 hex digest of the node names and link arrays
+
+        The digest is memoized until a Node records a change (see Node.touch).
+
+        :return: hex digest identifying this Network's content
+        :rtype: str
+        """
+        versions = tuple(tuple(sorted(node.versions.items())) for node in self.nodes)
+        if self._content_hash is not None and self._content_hash[0] == versions:
+            return self._content_hash[1]
+        digest = hashlib.sha1(repr((self.size, self.interactivity,
+                                    [node.name for node in self.nodes])).encode('utf-8'))
+        if self.storage == 'sparse':
+            arrays = self.sparse_indptr + self.sparse_indices + self.sparse_utilities
+        else:
+            arrays = self.utility_arrays()
+        for array in arrays:
+            digest.update(numpy.ascontiguousarray(array).data)
+        self._content_hash = (versions, digest.hexdigest())
+        return self._content_hash[1]
+
+    def save(self, path, metadata=None):
+        """Save this Network to a binary snapshot file
+
+        Dense and object networks are saved as a utility array and a
+        defined-link mask, and sparse networks as their compressed rows, along
+        with the node names and ``metadata``.
+
+        :param str path: snapshot file path
+        :param dict metadata: JSON-serializable metadata to save along
+        """
+        header = {'format': 'network', 'version': 1, 'size': self.size,
+                  'interactivity': self.interactivity, 'storage': self.storage,
+                  'names': [node.name for node in self.nodes], 'metadata': metadata or {}}
+        if self.storage == 'sparse':
+            arrays = {}
+            for response in range(self.interactivity):
+                arrays['indptr_%d' % response] = self.sparse_indptr[response]
+                arrays['indices_%d' % response] = self.sparse_indices[response]
+                arrays['utilities_%d' % response] = self.sparse_utilities[response]
+        else:
+            utilities, defined = self.utility_arrays()
+            arrays = {'utilities': utilities, 'defined': defined}
+        write_snapshot(path, header, arrays)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r', storage=None):
+        """Return a Network loaded from a binary snapshot file
+
+        With a ``mmap_mode``, dense and sparse link arrays are memory-mapped
+        from the file instead of copied, and with the default read-only mode
+        the Network pickles as just its snapshot path, so worker processes
+        can share it.
+
+        :param str path: snapshot file path
+        :param str mmap_mode: numpy.memmap mode ('r', 'r+', or 'c'), or None to read into memory
+        :param str storage: storage mode to load into (default: 'sparse' for
+            sparse snapshots, 'dense' otherwise)
+        :return: loaded Network
+        """
+        header, arrays = read_snapshot(path, mmap_mode)
+        saved_storage = 'sparse' if header['storage'] == 'sparse' else 'dense'
+        storage = storage or saved_storage
+        if storage not in ('object', saved_storage):
+            raise ValueError('Cannot load a %s snapshot as %s' % (header['storage'], storage))
+        network = cls(header['size'], header['interactivity'], storage=storage)
+        for node, name in zip(network.nodes, header['names']):
+            node.name = str(name)
+        network.node_ids = dict((node.name, node.id) for node in network.nodes)
+        network.snapshot_metadata = header['metadata']
+        if storage == 'sparse':
+            for response in range(network.interactivity):
+                network.sparse_indptr[response] = arrays['indptr_%d' % response]
+                network.sparse_indices[response] = arrays['indices_%d' % response]
+                network.sparse_utilities[response] = arrays['utilities_%d' % response]
+        elif storage == 'dense':
+            network.utilities = arrays['utilities']
+            network.defined = arrays['defined']
+        elif saved_storage == 'sparse':
+            for response in range(network.interactivity):
+                indptr = arrays['indptr_%d' % response]
+                indices = arrays['indices_%d' % response]
+                utilities = arrays['utilities_%d' % response]
+                for source_index in range(network.size):
+                    source = network.nodes[source_index]
+                    for position in range(indptr[source_index], indptr[source_index + 1]):
+                        destination = network.nodes[indices[position]]
+                        link = Link(source, destination, response, float(utilities[position]))
+                        source.links.setdefault(destination, {})[response] = link
+            return network
+        else:
+            for source_index, destination_index, response in zip(*numpy.nonzero(arrays['defined'])):
+                source, destination = network.nodes[source_index], network.nodes[destination_index]
+                link = Link(source, destination, int(response),
+                            float(arrays['utilities'][source_index, destination_index, response]))
+                source.links.setdefault(destination, {})[int(response)] = link
+            return network
+        if mmap_mode is not None:
+            network.snapshot_path = path
+            network.mmap_mode = mmap_mode
+        return network
+
+    def __getstate__(self):
+        if self.snapshot_path is not None and self.mmap_mode == 'r':
+            # Read-only snapshots are reopened by path instead of copied
+            return {'snapshot_path': self.snapshot_path, 'storage': self.storage}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if 'nodes' in state:
+            self.__dict__.update(state)
+            return
+        self.__dict__.update(Network.load(state['snapshot_path'], 'r', state['storage']).__dict__)
+        self._bind_link_views()
 
     def make_all_links(self):
         """Make 1-utility Links for all pairs of different nodes in self.nodes
@@ -29,6 +208,18 @@ class Network:
         Links are defined for a specific combination of source, destination, and
         response, where the response is the user input at the source Node.
         """
+        if self.storage == 'dense':
+            self.utilities[...] = 1
+            self.defined[...] = True
+            self.touch_all()
+            return
+        if self.storage == 'sparse':
+            for response in range(self.interactivity):
+                self.sparse_indptr[response] = numpy.arange(self.size + 1, dtype=numpy.int64) * self.size
+                self.sparse_indices[response] = numpy.tile(numpy.arange(self.size, dtype=numpy.int64), self.size)
+                self.sparse_utilities[response] = numpy.ones(self.size * self.size)
+            self.touch_all()
+            return
         for source, destination in product(self.nodes, self.nodes):
             for response in range(self.interactivity):
                 link = Link(source, destination, response, utility=1)
@@ -46,6 +237,22 @@ class Network:
         :param float density: fraction of defined Links over all Links
         :param float skew_power: Link utility distribution power (u~x^SP on (0, 1))
         """
+        if self.storage == 'dense':
+            shape = self.utilities.shape
+            self.defined |= numpy.random.random(shape) <= density
+            utilities = numpy.random.random(shape) ** skew_power
+            self.utilities[self.defined] = utilities[self.defined]
+            self.touch_all()
+            return
+        if self.storage == 'sparse':
+            for response in range(self.interactivity):
+                counts = numpy.random.binomial(self.size, density, size=self.size)
+                keys = self._sample_row_keys(counts)
+                self.sparse_indptr[response] = numpy.concatenate(([0], numpy.cumsum(counts)))
+                self.sparse_indices[response] = keys % self.size
+                self.sparse_utilities[response] = numpy.random.random(len(keys)) ** skew_power
+            self.touch_all()
+            return
         for source, destination in product(self.nodes, self.nodes):
             for response in range(self.interactivity):
                 # Skip some pairs, according to ``density``
@@ -59,13 +266,90 @@ class Network:
                 except KeyError:
                     source.links[destination] = {response: link}
 
+    def _sample_row_keys(self, counts):
+        """Return sorted (source * size + destination) keys of random distinct links
+
+        Each source gets ``counts[source]`` distinct uniformly random
+        destinations. Destinations are drawn with replacement and duplicates
+        are redrawn. Rows more than half full draw their undefined complement
+        instead, so every pass fills at least half of what is missing and the
+        work is proportional to the number of links.
+
+        :param counts: number of links to draw for each source
+        :return: sorted array of link keys
+        :rtype: numpy.ndarray
+        """
+        sources = numpy.arange(self.size, dtype=numpy.int64)
+        full_rows = 2 * counts > self.size
+        draw_counts = numpy.where(full_rows, self.size - counts, counts)
+        keys = numpy.zeros(0, dtype=numpy.int64)
+        missing = draw_counts
+        while missing.any():
+            new_sources = numpy.repeat(sources, missing)
+            new_keys = new_sources * self.size + numpy.random.randint(self.size, size=len(new_sources))
+            keys = numpy.unique(numpy.concatenate((keys, new_keys)))
+            missing = draw_counts - numpy.bincount(keys // self.size, minlength=self.size)
+        if not full_rows.any():
+            return keys
+        # Full rows keep every destination except the ones drawn for them
+        in_full_rows = full_rows[keys // self.size]
+        full_row_keys = (sources[full_rows][:, numpy.newaxis] * self.size + sources).ravel()
+        full_row_keys = full_row_keys[~numpy.in1d(full_row_keys, keys[in_full_rows], assume_unique=True)]
+        return numpy.sort(numpy.concatenate((keys[~in_full_rows], full_row_keys)))
+
+    def touch_all(self):
+        """Record a change to the Links leaving every Node under every response
+
+        Call this after writing to the link arrays directly.
+        """
+        for node in self.nodes:
+            for response in range(self.interactivity):
+                node.touch(response)
+
+    def row_version(self, node_index, response):
+        """Return the change count of the Links leaving a Node under ``response``
+
+        :param int node_index: index of the source Node
+        :param int response: user input at the source Node
+        :return: number of recorded changes
+        :rtype: int
+        """
+        return self.nodes[node_index].versions.get(response, 0)
+
+    def node_index(self, node):
+        """Return the index of a Node in self.nodes, which is its id
+
+        :param node: Node in this Network
+        :return: index of the Node in self.nodes
+        :rtype: int
+        """
+        return node.id
+
+    def node_id(self, name):
+        """Return the id of the Node with a name
+
+        :param str name: Node name
+        :return: Node id
+        :rtype: int
+        """
+        return self.node_ids[name]
+
+    def node_name(self, node_id):
+        """Return the name of the Node with an id
+
+        :param int node_id: Node id
+        :return: Node name
+        :rtype: str
+        """
+        return self.nodes[node_id].name
+
     def get_all_preferences(self):
-        """Return a tuple of all possible tuples of input preferences.
+        """Return a lazy sequence of all possible tuples of input preferences.
 
-        :return: tuple of all input preferences
-        :rtype: tuple
+        :return: all input preferences, in itertools.product order
+        :rtype: PreferenceSpace
         """
-        return tuple(sequence for sequence in product(range(self.interactivity), repeat=self.size))
+        return PreferenceSpace(self.size, self.interactivity)
 
     def get_random_preferences(self):
         """Return a random tuple of user input preferences, one for each node
@@ -75,42 +359,359 @@ class Network:
         """
         return tuple(random.choice(range(self.interactivity)) for _ in self.nodes)
 
+    def link_utilities(self, node_index, preference):
+        """Return an array of utilities of links leaving a node
+
+        The utility is 0 for any undefined links.
+
+        :param int node_index: index of the source node in self.nodes
+        :param int preference: user input at the source node
+        :return: array of utilities, one for each destination in self.nodes
+        :rtype: numpy.ndarray
+        """
+        if self.storage == 'dense':
+            return self.utilities[node_index, :, preference].copy()
+        if self.storage == 'sparse':
+            utilities = numpy.zeros(self.size)
+            destination_indices, defined_utilities = self.defined_links(node_index, preference)
+            utilities[destination_indices] = defined_utilities
+            return utilities
+        links = self.nodes[node_index].links
+        utilities = numpy.zeros(self.size)
+        for destination_index, destination in enumerate(self.nodes):
+            try:
+                utilities[destination_index] = links[destination][preference].utility
+            except KeyError:
+                pass
+        return utilities
+
+    def defined_links(self, node_index, preference):
+        """Return the destination indices and utilities of defined links leaving a node
+
+        :param int node_index: index of the source node in self.nodes
+        :param int preference: user input at the source node
+        :return: sorted array of destination indices and array of their utilities
+        :rtype: tuple
+        """
+        if self.storage == 'sparse':
+            start, stop = self.sparse_indptr[preference][node_index:node_index + 2]
+            return (self.sparse_indices[preference][start:stop],
+                    self.sparse_utilities[preference][start:stop])
+        if self.storage == 'dense':
+            destination_indices = numpy.flatnonzero(self.defined[node_index, :, preference])
+            return destination_indices, self.utilities[node_index, destination_indices, preference]
+        links = self.nodes[node_index].links
+        destination_indices = sorted(self.node_index(destination) for destination in links
+                                     if preference in links[destination])
+        utilities = [links[self.nodes[index]][preference].utility for index in destination_indices]
+        return numpy.array(destination_indices, dtype=numpy.int64), numpy.array(utilities, dtype=float)
+
+    def _sparse_position(self, source_index, destination_index, preference):
+        """Return the position of a link in the sparse arrays, or None if undefined
+        """
+        start, stop = self.sparse_indptr[preference][source_index:source_index + 2]
+        row = self.sparse_indices[preference][start:stop]
+        position = numpy.searchsorted(row, destination_index)
+        if position < len(row) and row[position] == destination_index:
+            return start + position
+        return None
+
+    def is_defined(self, source_index, destination_index, preference):
+        """Return whether a Link is defined
+
+        :param int source_index: index of the source Node
+        :param int destination_index: index of the destination Node
+        :param int preference: user input at the source Node
+        :rtype: bool
+        """
+        if not 0 <= preference < self.interactivity:
+            return False
+        if self.storage == 'dense':
+            return bool(self.defined[source_index, destination_index, preference])
+        if self.storage == 'sparse':
+            return self._sparse_position(source_index, destination_index, preference) is not None
+        links = self.nodes[source_index].links
+        destination = self.nodes[destination_index]
+        return destination in links and preference in links[destination]
+
+    def get_utility(self, source_index, destination_index, preference):
+        """Return the utility of a defined Link
+
+        :param int source_index: index of the source Node
+        :param int destination_index: index of the destination Node
+        :param int preference: user input at the source Node
+        :return: utility of the Link
+        :rtype: float
+        :raises KeyError: if the Link is undefined
+        """
+        if not self.is_defined(source_index, destination_index, preference):
+            raise KeyError((source_index, destination_index, preference))
+        if self.storage == 'dense':
+            return self.utilities[source_index, destination_index, preference]
+        if self.storage == 'sparse':
+            position = self._sparse_position(source_index, destination_index, preference)
+            return self.sparse_utilities[preference][position]
+        destination = self.nodes[destination_index]
+        return self.nodes[source_index].links[destination][preference].utility
+
+    def set_utility(self, source_index, destination_index, preference, utility):
+        """Set the utility of a defined Link
+
+        :param int source_index: index of the source Node
+        :param int destination_index: index of the destination Node
+        :param int preference: user input at the source Node
+        :param float utility: new utility of the Link
+        :raises KeyError: if the Link is undefined
+        """
+        if not self.is_defined(source_index, destination_index, preference):
+            raise KeyError((source_index, destination_index, preference))
+        if self.storage == 'dense':
+            self.utilities[source_index, destination_index, preference] = utility
+            self.nodes[source_index].touch(preference)
+        elif self.storage == 'sparse':
+            position = self._sparse_position(source_index, destination_index, preference)
+            self.sparse_utilities[preference][position] = utility
+            self.nodes[source_index].touch(preference)
+        else:
+            destination = self.nodes[destination_index]
+            self.nodes[source_index].links[destination][preference].utility = utility
+
+    def multiply_utility(self, source_index, destination_index, preference, factor):
+        """Multiply the utility of a defined Link by ``factor``
+
+        :param int source_index: index of the source Node
+        :param int destination_index: index of the destination Node
+        :param int preference: user input at the source Node
+        :param float factor: multiplicative factor
+        :raises KeyError: if the Link is undefined
+        """
+        if self.storage == 'dense':
+            if not self.defined[source_index, destination_index, preference]:
+                raise KeyError((source_index, destination_index, preference))
+            self.utilities[source_index, destination_index, preference] *= factor
+            self.nodes[source_index].touch(preference)
+        else:
+            utility = self.get_utility(source_index, destination_index, preference)
+            self.set_utility(source_index, destination_index, preference, utility * factor)
+
+    def transition_matrix(self, preferences, probability_conversion):
+        """Return a matrix of step probabilities between all pairs of nodes
+
+        Row i holds the probabilities of stepping from the i-th node to every
+        node, given the user input ``preferences[i]`` at the i-th node.
+
+        :param tuple preferences: user input at each node in self.nodes
+        :param probability_conversion: function converting utilities to probabilities
+        :return: size-by-size array of step probabilities
+        :rtype: numpy.ndarray
+        """
+        matrix = numpy.empty((self.size, self.size))
+        for node_index in range(self.size):
+            utilities = self.link_utilities(node_index, preferences[node_index])
+            matrix[node_index] = probability_conversion(utilities)
+        return matrix
+
     def sequence_probabilities(self, preferences, sequence_length, probability_conversion):
         """Return a list of probabilities for every possible sequence
 
+        Sequences are ordered as in ``itertools.product(self.nodes, repeat=sequence_length)``.
+        The transition matrix is built once, and each sequence probability is
+        the uniform start probability times one matrix entry per step.
+
         :return: list of probabilities for every possible sequence
         :rtype: list
         """
-        sequences = list(product(self.nodes, repeat=sequence_length))
-        sequence_probabilities = [1.0 / len(self.nodes)] * len(sequences)
-        progress_bar_size = 50
-        progress_step = 2
-        print 'Probabilities\t|' + ' ' * progress_bar_size + '|',
-        for sequence_index in range(len(sequences)):
-            if not sequence_index % (len(sequences) * progress_step / 100) and sequence_index:
-                progress_percent = int(100 * sequence_index / len(sequences))
-                print('\rProbabilities\t|' + '-' * (progress_percent * progress_bar_size / 100) +
-                      ' ' * ((100 - progress_percent) * progress_bar_size / 100) + '|'),
-            for sequence_step in range(sequence_length - 1):
-                this_node = sequences[sequence_index][sequence_step]
-                next_node = sequences[sequence_index][sequence_step + 1]
-                preference = preferences[self.nodes.index(this_node)]
-                utilities = []
-                for other_node in self.nodes:
-                    try:
-                        utilities.append(this_node.links[other_node][preference].utility)
-                    except KeyError:
-                        utilities.append(0)
-                probabilities = probability_conversion(utilities)
-                step_probability = probabilities[self.nodes.index(next_node)]
-                sequence_probabilities[sequence_index] *= step_probability
-        print '\rProbabilities\t|' + '-' * progress_bar_size + '|'
+        matrix = self.transition_matrix(preferences, probability_conversion)
+        sequence_probabilities = matrix_sequence_probabilities(matrix, sequence_length).tolist()
         assert sum(sequence_probabilities) < 1.0001
         assert sum(sequence_probabilities) > 0.9999
         return sequence_probabilities
 
+    def top_sequences(self, preferences, sequence_length, k, probability_conversion):
+        """Return the k most probable sequences, most probable first
+
+        Partial sequences are expanded best-first, ranked by their probability
+        times the best probability any continuation of the remaining steps can
+        reach. That bound is exact for complete sequences and never too low
+        for partial ones, so complete sequences come off the heap in order
+        without materializing all size^sequence_length sequences.
+
+        :param tuple preferences: user input at each node in self.nodes
+        :param int sequence_length: length of sequences
+        :param int k: number of sequences to return
+        :param probability_conversion: function converting utilities to probabilities
+        :return: list of (tuple of node indices, probability) pairs
+        :rtype: list
+        """
+        return matrix_top_sequences(self.transition_matrix(preferences, probability_conversion), sequence_length, k)
+
+    def log_sequence_probabilities(self, preferences, sequence_length, log_probability_conversion):
+        """Return a list of log-probabilities for every possible sequence
+
+        Like sequence_probabilities, but step log-probabilities are summed
+        instead of step probabilities multiplied, so long sequences and large
+        epsilons do not underflow.
+
+        :param tuple preferences: user input at each node in self.nodes
+        :param int sequence_length: length of sequences
+        :param log_probability_conversion: function converting utilities to log-probabilities
+        :return: list of log-probabilities for every possible sequence
+        :rtype: list
+        """
+        log_matrix = self.transition_matrix(preferences, log_probability_conversion)
+        log_sequence_probabilities = numpy.full(self.size, -numpy.log(self.size))
+        for _ in range(sequence_length - 1):
+            # The last node of the k-th sequence is the (k % size)-th node
+            last_node_indices = numpy.arange(len(log_sequence_probabilities)) % self.size
+            log_sequence_probabilities = (log_sequence_probabilities[:, numpy.newaxis] +
+                                          log_matrix[last_node_indices]).ravel()
+        return log_sequence_probabilities.tolist()
+
+
+def matrix_sequence_probabilities(matrix, sequence_length):
+    """Return an array of probabilities for every sequence of a Markov chain with a uniform start
+
+    Sequences are ordered as in ``itertools.product(range(size), repeat=sequence_length)``.
+
+    :param matrix: size-by-size transition matrix
+    :param int sequence_length: length of sequences
+    :return: array of size^sequence_length sequence probabilities
+    :rtype: numpy.ndarray
+    """
+    size = len(matrix)
+    sequence_probabilities = numpy.ones(size) / size
+    for _ in range(sequence_length - 1):
+        # The last node of the k-th sequence is the (k % size)-th node
+        last_node_indices = numpy.arange(len(sequence_probabilities)) % size
+        sequence_probabilities = (sequence_probabilities[:, numpy.newaxis] *
+                                  matrix[last_node_indices]).ravel()
+    return sequence_probabilities
+
+
+def matrix_top_sequences(matrix, sequence_length, k):
+    """Return the k most probable sequences of a Markov chain with a uniform start
+
+    See Network.top_sequences.
+
+    :param matrix: size-by-size transition matrix
+    :param int sequence_length: length of sequences
+    :param int k: number of sequences to return
+    :return: list of (tuple of node indices, probability) pairs, most probable first
+    :rtype: list
+    """
+    size = len(matrix)
+    # best_continuations[t][i] is the highest probability of t more steps from node i
+    best_continuations = [numpy.ones(size)]
+    for _ in range(sequence_length - 1):
+        best_continuations.append((matrix * best_continuations[-1]).max(axis=1))
+    heap = [(-best_continuations[sequence_length - 1][index] / size, (index,), 1.0 / size)
+            for index in range(size)]
+    heapq.heapify(heap)
+    top_sequences = []
+    while heap and len(top_sequences) < k:
+        _, sequence, probability = heapq.heappop(heap)
+        if len(sequence) == sequence_length:
+            top_sequences.append((sequence, probability))
+            continue
+        remaining_steps = sequence_length - len(sequence) - 1
+        for next_index in numpy.flatnonzero(matrix[sequence[-1]]).tolist():
+            next_probability = probability * matrix[sequence[-1], next_index]
+            priority = next_probability * best_continuations[remaining_steps][next_index]
+            heapq.heappush(heap, (-priority, sequence + (next_index,), next_probability))
+    return top_sequences
+
+
+class PreferenceSpace:
+    """Lazy, indexable sequence of all preference tuples of a Network
+
+    The i-th tuple holds the base-``interactivity`` digits of i, most
+    significant first, which is the order of itertools.product. Tuples are
+    computed on demand, so the space is O(1) to build at any size.
+
+    :param int size: number of Nodes
+    :param int interactivity: number of user inputs possible at every Node
+    :ivar int size: number of Nodes
+    :ivar int interactivity: number of user inputs possible at every Node
+    :ivar count: number of preference tuples, interactivity ** size
+    """
+
+    def __init__(self, size, interactivity):
+        self.size = size
+        self.interactivity = interactivity
+        self.count = interactivity ** size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('Preference index out of range')
+        preferences = [0] * self.size
+        for position in range(self.size - 1, -1, -1):
+            index, digit = divmod(index, self.interactivity)
+            preferences[position] = int(digit)
+        return tuple(preferences)
+
+    def __iter__(self):
+        return product(range(self.interactivity), repeat=self.size)
+
+    def iterate(self, start=0, order='round-robin'):
+        """Yield preference tuples forever
+
+        :param int start: index of the first tuple, in round-robin order
+        :param str order: 'round-robin' to cycle through the tuples in order,
+            or 'random' to draw uniformly random tuples
+        """
+        index = start % self.count
+        while True:
+            if order == 'random':
+                yield tuple(random.randrange(self.interactivity) for _ in range(self.size))
+            else:
+                yield self[index]
+                index = (index + 1) % self.count
+
+    def batch(self, start, count):
+        """Return ``count`` consecutive preference tuples from ``start``, cycling
+
+        :param int start: index of the first tuple
+        :param int count: number of tuples
+        :return: (count, size) array of user inputs
+        :rtype: numpy.ndarray
+        """
+        if self.count < 2 ** 62:
+            indices = (start + numpy.arange(count, dtype=numpy.int64)) % self.count
+            powers = self.interactivity ** numpy.arange(self.size - 1, -1, -1, dtype=numpy.int64)
+            return indices[:, numpy.newaxis] // powers % self.interactivity
+        return numpy.array([self[(start + i) % self.count] for i in range(count)], dtype=numpy.int64)
 
-class Link:
+    def random_batch(self, count, random_state=None):
+        """Return ``count`` uniformly random preference tuples
+
+        :param int count: number of tuples
+        :param random_state: numpy RandomState to draw from (default: numpy.random)
+        :return: (count, size) array of user inputs
+        :rtype: numpy.ndarray
+        """
+        random_state = numpy.random if random_state is None else random_state
+        return random_state.randint(self.interactivity, size=(count, self.size))
+
+
+def _slot_state(instance):
+    """Return the set slot values of an instance, for pickle protocols below 2
+
+    Slots shadowed by a subclass property, like ArrayLink.source, are skipped.
+    """
+    state = {}
+    for cls in type(instance).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if getattr(type(instance), name) is vars(cls)[name] and hasattr(instance, name):
+                state[name] = getattr(instance, name)
+    return state
+
+
+class Link(object):
     """Link in a Network, connecting two source and destination Nodes
 
     :param source: source Node
@@ -120,15 +721,34 @@ class Link:
     :ivar source: source Node
     :ivar destination: destination Node
     :ivar int preference: user input at source Node
-    :ivar float utility: utility of use
+    :ivar float utility: utility of use, marking the source Node as changed when set
     """
 
+    __slots__ = ('source', 'destination', 'preference', '_utility')
+
     def __init__(self, source, destination, preference, utility):
         self.source = source
         self.destination = destination
         self.preference = preference
         self.utility = utility
 
+    @property
+    def utility(self):
+        return self._utility
+
+    @utility.setter
+    def utility(self, utility):
+        self._utility = utility
+        self.source.touch(self.preference)
+
+    def __getstate__(self):
+        return _slot_state(self)
+
+    def __setstate__(self, state):
+        # Slots are set directly, so restoring utilities does not touch the source
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __repr__(self):
         return ('Link ' + str(self.source) + ' to ' + str(self.destination) +
                 ' \t if %d \t utility %.3g' % (self.preference, self.utility))
@@ -138,17 +758,136 @@ class Link:
                 ' \t if %d \t utility %.3g' % (self.preference, self.utility))
 
 
-class Node:
+class ArrayLink(Link):
+    """Link view onto the utility arrays of a dense or sparse Network
+
+    :param network: Network holding the Link utility
+    :param int source_index: index of the source Node
+    :param int destination_index: index of the destination Node
+    :param int preference: user input at source Node
+    :ivar network: Network holding the Link utility
+    :ivar int preference: user input at source Node
+    """
+
+    __slots__ = ('network', 'source_index', 'destination_index')
+
+    def __init__(self, network, source_index, destination_index, preference):
+        self.network = network
+        self.source_index = source_index
+        self.destination_index = destination_index
+        self.preference = preference
+
+    @property
+    def source(self):
+        return self.network.nodes[self.source_index]
+
+    @property
+    def destination(self):
+        return self.network.nodes[self.destination_index]
+
+    @property
+    def utility(self):
+        return self.network.get_utility(self.source_index, self.destination_index, self.preference)
+
+    @utility.setter
+    def utility(self, utility):
+        self.network.set_utility(self.source_index, self.destination_index, self.preference, utility)
+
+
+class ArrayLinks(Mapping):
+    """Read-only view of the Links leaving a Node of a dense or sparse Network
+
+    Maps each destination Node with at least one defined Link to a mapping of
+    responses to ArrayLinks, like the dict of dicts of an object-mode Node.
+
+    :param network: Network holding the Links
+    :param int source_index: index of the source Node
+    """
+
+    def __init__(self, network, source_index):
+        self.network = network
+        self.source_index = source_index
+
+    def _destination_indices(self):
+        return sorted(set().union(*[self.network.defined_links(self.source_index, response)[0].tolist()
+                                    for response in range(self.network.interactivity)]))
+
+    def __getitem__(self, destination):
+        destination_index = self.network.node_index(destination)
+        response_links = ArrayResponseLinks(self.network, self.source_index, destination_index)
+        if not len(response_links):
+            raise KeyError(destination)
+        return response_links
+
+    def __iter__(self):
+        return (self.network.nodes[index] for index in self._destination_indices())
+
+    def __len__(self):
+        return len(self._destination_indices())
+
+
+class ArrayResponseLinks(Mapping):
+    """Read-only view of the Links between two Nodes of a dense or sparse Network, keyed by response
+
+    :param network: Network holding the Links
+    :param int source_index: index of the source Node
+    :param int destination_index: index of the destination Node
+    """
+
+    def __init__(self, network, source_index, destination_index):
+        self.network = network
+        self.source_index = source_index
+        self.destination_index = destination_index
+
+    def __getitem__(self, response):
+        try:
+            defined = self.network.is_defined(self.source_index, self.destination_index, response)
+        except TypeError:
+            raise KeyError(response)
+        if not defined:
+            raise KeyError(response)
+        return ArrayLink(self.network, self.source_index, self.destination_index, response)
+
+    def __iter__(self):
+        return (response for response in range(self.network.interactivity)
+                if self.network.is_defined(self.source_index, self.destination_index, response))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class Node(object):
     """Node in a Network, connected to other nodes by weighted Links
 
     :param str name: node ID or descriptor
+    :param int node_id: integer id, the Node's index in its Network
     :ivar str name: node ID or descriptor
+    :ivar int id: integer id, the Node's index in its Network
     :ivar dict links: neighbor Nodes keying to Links
+    :ivar dict versions: responses keying to counts of changes to Links leaving this Node
     """
 
-    def __init__(self, name):
+    __slots__ = ('name', 'id', 'links', 'versions')
+
+    def __init__(self, name, node_id=None):
         self.name = name
+        self.id = node_id
         self.links = {}
+        self.versions = {}
+
+    def touch(self, response):
+        """Record a change to the Links leaving this Node under ``response``
+
+        :param int response: user input of the changed Links
+        """
+        self.versions[response] = self.versions.get(response, 0) + 1
+
+    def __getstate__(self):
+        return _slot_state(self)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def __repr__(self):
         return self.name
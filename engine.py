@@ -0,0 +1,115 @@
+from database import matrix_sequence_probabilities, matrix_top_sequences
+from metrics import markov_kl_divergence
+import numpy
+
+
+class ProbabilityEngine:
+    """Sequence results of a Network, kept up to date one row at a time
+
+    Transition matrices are cached per preference tuple along with the
+    version (see Network.row_version) of every (node, response) row they were
+    built from. When a matrix is asked for again, only rows whose version
+    changed since are converted again, and results derived from that matrix
+    are dropped. A pirating adversary touches only the rows it saw, so a
+    learning curve costs about one full evaluation plus the changed rows.
+
+    :param network: Network to evaluate
+    :param probability_conversion: function converting utilities to probabilities
+    :ivar network: Network to evaluate
+    :ivar probability_conversion: function converting utilities to probabilities
+    :ivar int rows_converted: number of rows converted to probabilities so far
+    """
+
+    def __init__(self, network, probability_conversion):
+        self.network = network
+        self.probability_conversion = probability_conversion
+        self.rows_converted = 0
+        self._matrices = {}
+        self._versions = {}
+        self._generations = {}
+        self._results = {}
+
+    def transition_matrix(self, preferences):
+        """Return the up-to-date transition matrix of a preference tuple
+
+        The returned array is cached, so do not modify it.
+
+        :param tuple preferences: user input at each node
+        :return: size-by-size array of step probabilities
+        :rtype: numpy.ndarray
+        """
+        preferences = tuple(int(preference) for preference in preferences)
+        versions = numpy.array([self.network.row_version(node_index, preferences[node_index])
+                                for node_index in range(self.network.size)])
+        if preferences not in self._matrices:
+            self._matrices[preferences] = numpy.empty((self.network.size, self.network.size))
+            self._generations[preferences] = 0
+            dirty_rows = numpy.arange(self.network.size)
+        else:
+            dirty_rows = numpy.flatnonzero(versions != self._versions[preferences])
+        if len(dirty_rows):
+            matrix = self._matrices[preferences]
+            for node_index in dirty_rows.tolist():
+                utilities = self.network.link_utilities(node_index, preferences[node_index])
+                matrix[node_index] = self.probability_conversion(utilities)
+            self.rows_converted += len(dirty_rows)
+            self._versions[preferences] = versions
+            self._generations[preferences] += 1
+            self._results.pop(preferences, None)
+        return self._matrices[preferences]
+
+    def generation(self, preferences):
+        """Return the number of times a preference tuple's matrix has changed
+
+        :param tuple preferences: user input at each node
+        :rtype: int
+        """
+        self.transition_matrix(preferences)
+        return self._generations[tuple(int(preference) for preference in preferences)]
+
+    def sequence_probabilities(self, preferences, sequence_length):
+        """Return a list of probabilities for every possible sequence
+
+        See Network.sequence_probabilities.
+
+        :param tuple preferences: user input at each node
+        :param int sequence_length: length of sequences
+        :rtype: list
+        """
+        return self._memoize(preferences, ('sequence_probabilities', sequence_length),
+                             lambda matrix: matrix_sequence_probabilities(matrix, sequence_length).tolist())
+
+    def top_sequences(self, preferences, sequence_length, k):
+        """Return the k most probable sequences, most probable first
+
+        See Network.top_sequences.
+
+        :param tuple preferences: user input at each node
+        :param int sequence_length: length of sequences
+        :param int k: number of sequences to return
+        :return: list of (tuple of node indices, probability) pairs
+        :rtype: list
+        """
+        return self._memoize(preferences, ('top_sequences', sequence_length, k),
+                             lambda matrix: matrix_top_sequences(matrix, sequence_length, k))
+
+    def kl_divergence(self, reference, preferences, sequence_length):
+        """Calculate the KL divergence of this Network's sequence distribution from a reference's
+
+        :param reference: ProbabilityEngine of the original Network
+        :param tuple preferences: user input at each node
+        :param int sequence_length: length of sequences
+        :return: KL divergence of this engine's sequence distribution
+        :rtype: float
+        """
+        reference_matrix = reference.transition_matrix(preferences)
+        key = ('kl_divergence', sequence_length, id(reference), reference.generation(preferences))
+        return self._memoize(preferences, key,
+                             lambda matrix: markov_kl_divergence(reference_matrix, matrix, sequence_length))
+
+    def _memoize(self, preferences, key, compute):
+        matrix = self.transition_matrix(preferences)
+        results = self._results.setdefault(tuple(int(preference) for preference in preferences), {})
+        if key not in results:
+            results[key] = compute(matrix)
+        return results[key]
@@ -0,0 +1,202 @@
+"""Headless parameter sweeps over the content network privacy model
+
+Every cell of a parameter grid is run ``repeats`` times on a process pool,
+each run seeded deterministically from the sweep seed, the cell parameters,
+and the repeat number. Result rows are streamed to a CSV file as runs finish,
+and load_results reads them back as columns for plotting. Curator-side results
+are kept in result_cache, keyed by network content, so with a cache directory
+a rerun of the same sweep skips them.
+
+Example::
+
+    python experiments.py results.csv --repeats 5 --grid density=0.2,0.4,0.6,0.8 --cache-dir cache
+"""
+from adversary import Adversary
+import argparse
+from cache import ResultCache
+import csv
+from curator import Curator
+from database import Network
+from itertools import product
+from metrics import sequence_kl_divergence, top_sequence_error
+import multiprocessing
+import numpy
+import random
+import zlib
+
+DEFAULT_GRID = {
+    'epsilon': [100],
+    'density': [0.1],
+    'size': [10],
+    'interactivity': [2],
+    'sequence_length': [4],
+    'skew_power': [1],
+    'eta': [1e-4],
+    'queries': [1000],
+    'cutoff_fraction': [0.1],
+}
+PARAMETER_TYPES = {'size': int, 'interactivity': int, 'sequence_length': int, 'queries': int}
+result_cache = ResultCache()
+
+
+def grid_cells(grid):
+    """Return every combination of the grid's parameter values
+
+    :param dict grid: parameter names keying to lists of values
+    :return: list of dicts of parameter names keying to values
+    :rtype: list
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in product(*[grid[name] for name in names])]
+
+
+def cell_seed(seed, cell, repeat):
+    """Return the deterministic seed of one run of a grid cell
+
+    :param int seed: sweep seed
+    :param dict cell: parameter names keying to values
+    :param int repeat: repeat number
+    :rtype: int
+    """
+    return zlib.crc32(repr((seed, sorted(cell.items()), repeat)).encode('utf-8')) & 0x7fffffff
+
+
+def run_cell(cell, seed):
+    """Pirate a random curator network and measure how well the adversary did
+
+    :param dict cell: epsilon, density, size, interactivity, sequence_length,
+        skew_power, eta, queries, and cutoff_fraction
+    :param int seed: seed of the random and numpy.random generators
+    :return: result names keying to values
+    :rtype: dict
+    """
+    random.seed(seed)
+    numpy.random.seed(seed)
+    curator = Curator(epsilon=cell['epsilon'])
+    curator.network = Network(cell['size'], cell['interactivity'], storage='dense')
+    curator.network.make_random_links(density=cell['density'], skew_power=cell['skew_power'])
+    adversary = Adversary(curator, eta=cell['eta'], storage='dense', counting=True)
+    adversary.pirate(cell['sequence_length'], number_of_queries=cell['queries'])
+    preferences = curator.network.get_random_preferences()
+    cutoff_number = max(1, int(cell['cutoff_fraction'] * cell['size'] ** cell['sequence_length']))
+    curator_top_sequences = [sequence for sequence, _ in
+                             result_cache.top_sequences(curator.network, preferences, cell['sequence_length'],
+                                                        cutoff_number, curator.exponential_mechanism)]
+    adversary_top_sequences = [sequence for sequence, _ in
+                               adversary.network.top_sequences(preferences, cell['sequence_length'],
+                                                               cutoff_number, Adversary.normalize)]
+    return {
+        'kl_divergence': sequence_kl_divergence(curator.network, adversary.network, preferences,
+                                                cell['sequence_length'], curator.exponential_mechanism,
+                                                Adversary.normalize),
+        'top_sequence_error': top_sequence_error(curator_top_sequences, adversary_top_sequences),
+    }
+
+
+def _use_cache_directory(directory):
+    """Point a pool worker's result_cache at an on-disk tier
+    """
+    global result_cache
+    result_cache = ResultCache(directory=directory)
+
+
+def _run_task(task):
+    """Run one repeat of one grid cell in a pool worker
+    """
+    cell_function, cell_number, cell, repeat, seed = task
+    return cell_number, cell, repeat, seed, cell_function(cell, seed)
+
+
+def run_sweep(grid, path, repeats=1, processes=None, seed=0, cell_function=run_cell, cache_directory=None):
+    """Run every cell of a parameter grid on a process pool and stream results to CSV
+
+    Each row holds the cell number, the cell parameters, the repeat number,
+    the run seed, and the results of ``cell_function(cell, seed)``. Rows are
+    written in completion order, so sort by cell and repeat when needed.
+
+    :param dict grid: parameter names keying to lists of values
+    :param str path: CSV file path
+    :param int repeats: number of runs of every cell
+    :param int processes: number of worker processes (default: number of CPUs)
+    :param int seed: sweep seed
+    :param cell_function: function of a cell dict and a seed returning a dict of results
+    :param str cache_directory: directory of result_cache's on-disk tier, if any
+    :return: number of rows written
+    :rtype: int
+    """
+    tasks = [(cell_function, cell_number, cell, repeat, cell_seed(seed, cell, repeat))
+             for cell_number, cell in enumerate(grid_cells(grid)) for repeat in range(repeats)]
+    parameter_names = sorted(grid)
+    if cache_directory is None:
+        pool = multiprocessing.Pool(processes)
+    else:
+        pool = multiprocessing.Pool(processes, _use_cache_directory, (cache_directory,))
+    rows = 0
+    try:
+        with open(path, 'w') as results_file:
+            writer = None
+            for cell_number, cell, repeat, run_seed, results in pool.imap_unordered(_run_task, tasks):
+                if writer is None:
+                    result_names = sorted(results)
+                    writer = csv.writer(results_file)
+                    writer.writerow(['cell'] + parameter_names + ['repeat', 'seed'] + result_names)
+                writer.writerow([cell_number] + [cell[name] for name in parameter_names] +
+                                [repeat, run_seed] + [repr(results[name]) for name in result_names])
+                results_file.flush()
+                rows += 1
+    finally:
+        pool.close()
+        pool.join()
+    return rows
+
+
+def load_results(path):
+    """Return the columns of a sweep results CSV file
+
+    Numeric columns are returned as float arrays, others as string arrays.
+
+    :param str path: CSV file path
+    :return: column names keying to arrays
+    :rtype: dict
+    """
+    with open(path) as results_file:
+        reader = csv.reader(results_file)
+        names = next(reader)
+        rows = list(reader)
+    columns = {}
+    for index, name in enumerate(names):
+        values = [row[index] for row in rows]
+        try:
+            columns[name] = numpy.array([float(value) for value in values])
+        except ValueError:
+            columns[name] = numpy.array(values)
+    return columns
+
+
+def parse_grid(assignments):
+    """Return DEFAULT_GRID updated with ``name=value,value`` assignments
+
+    :param list assignments: strings like 'density=0.2,0.4'
+    :rtype: dict
+    """
+    grid = dict(DEFAULT_GRID)
+    for assignment in assignments:
+        name, values = assignment.split('=', 1)
+        if name not in grid:
+            raise ValueError('Unknown parameter: %s' % name)
+        grid[name] = [PARAMETER_TYPES.get(name, float)(value) for value in values.split(',')]
+    return grid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a parameter sweep of the privacy model')
+    parser.add_argument('path', help='results CSV file')
+    parser.add_argument('--grid', nargs='*', default=[], help='parameter values, like density=0.2,0.4')
+    parser.add_argument('--repeats', type=int, default=1, help='runs of every grid cell')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='sweep seed')
+    parser.add_argument('--cache-dir', default=None, help='directory of cached curator results')
+    arguments = parser.parse_args()
+    print 'Wrote %d rows' % run_sweep(parse_grid(arguments.grid), arguments.path, arguments.repeats,
+                                      arguments.processes, arguments.seed,
+                                      cache_directory=arguments.cache_dir)
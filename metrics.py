@@ -0,0 +1,84 @@
+import numpy
+
+
+def kl_divergence(distribution, approx_distribution):
+    """Calculate the KL divergence for two distributions
+
+    Terms where ``distribution`` is 0 contribute 0.
+
+    :param distribution: original probability distribution
+    :param approx_distribution: approximate of the original distribution
+    :return: KL divergence of ``approx_distribution`` from ``distribution``
+    :rtype: float
+    """
+    distribution = numpy.asarray(distribution, dtype=float)
+    approx_distribution = numpy.asarray(approx_distribution, dtype=float)
+    support = distribution > 0
+    with numpy.errstate(divide='ignore'):
+        return float(numpy.sum(distribution[support] *
+                               numpy.log(distribution[support] / approx_distribution[support])))
+
+
+def markov_kl_divergence(matrix, approx_matrix, sequence_length, initial=None, approx_initial=None):
+    """Calculate the KL divergence of the sequence distributions of two Markov chains
+
+    For first-order chains the sequence-level divergence is the divergence of
+    the start distributions plus, for every step, the expected divergence of
+    the transition rows under the original chain's distribution at that step.
+    This costs O(sequence_length * size^2) instead of enumerating size^length
+    sequences.
+
+    :param matrix: original size-by-size transition matrix
+    :param approx_matrix: approximate size-by-size transition matrix
+    :param int sequence_length: length of sequences
+    :param initial: original start distribution (default: uniform)
+    :param approx_initial: approximate start distribution (default: uniform)
+    :return: KL divergence of the approximate sequence distribution
+    :rtype: float
+    """
+    matrix = numpy.asarray(matrix, dtype=float)
+    approx_matrix = numpy.asarray(approx_matrix, dtype=float)
+    size = len(matrix)
+    initial = numpy.ones(size) / size if initial is None else numpy.asarray(initial, dtype=float)
+    approx_initial = numpy.ones(size) / size if approx_initial is None else approx_initial
+    row_divergences = numpy.array([kl_divergence(matrix[i], approx_matrix[i]) for i in range(size)])
+    divergence = kl_divergence(initial, approx_initial)
+    state = initial
+    for _ in range(sequence_length - 1):
+        # Rows the chain cannot be in do not contribute, even if infinite
+        reachable = state > 0
+        divergence += state[reachable].dot(row_divergences[reachable])
+        state = state.dot(matrix)
+    return float(divergence)
+
+
+def sequence_kl_divergence(network, approx_network, preferences, sequence_length,
+                           probability_conversion, approx_probability_conversion):
+    """Calculate the KL divergence of two networks' sequence distributions
+
+    Both networks start uniformly, as in Network.sequence_probabilities.
+
+    :param network: original Network
+    :param approx_network: approximate Network
+    :param tuple preferences: user input at each node
+    :param int sequence_length: length of sequences
+    :param probability_conversion: utility conversion of the original Network
+    :param approx_probability_conversion: utility conversion of the approximate Network
+    :return: KL divergence of the approximate sequence distribution
+    :rtype: float
+    """
+    matrix = network.transition_matrix(preferences, probability_conversion)
+    approx_matrix = approx_network.transition_matrix(preferences, approx_probability_conversion)
+    return markov_kl_divergence(matrix, approx_matrix, sequence_length)
+
+
+def top_sequence_error(top_sequences, approx_top_sequences):
+    """Calculate the fraction of top sequences missing from the approximate top sequences
+
+    :param top_sequences: original most probable sequences
+    :param approx_top_sequences: approximate most probable sequences
+    :return: fraction of ``top_sequences`` not in ``approx_top_sequences``
+    :rtype: float
+    """
+    top_sequences = set(top_sequences)
+    return 1.0 - 1.0 * len(top_sequences & set(approx_top_sequences)) / len(top_sequences)
@@ -1,36 +1,54 @@
 import numpy as np
 import numpy.random as random
 import matplotlib.pyplot as pl
-import sys
 import plot_defaults
 
 ##################
 ### Parameters ###
 
-num_songs = 1e2 # number of songs in songspace
+num_songs = int(1e2) # number of songs in songspace
 frac = 1e-1 # fraction of songs in songspace that are intended
 power = 1e0 # for skewing the utilities toward 0 (power > 1) or 1 (power < 1)
 
 ##################
 
-def pick_song(probs_all):
-    # songs indicies are 0 to num_songs - 1, with intended songs occupying lower indices
-    return random.choice(int(num_songs), p=probs_all)
-
 def KL_divergence(distribution, approx_distribution):
-    return np.sum(distribution * np.log(distribution / approx_distribution))
+    # divergences of every row of `approx_distribution`
+    return np.sum(distribution * np.log(distribution / approx_distribution), axis=-1)
 
-def pirate(N, eta, probs_all):
+def estimate(counts, eta):
+    '''
+    Multiplicative weights estimate of the song probabilities after hearing each song `counts` times.
+    '''
+    # shifting by the largest count keeps exp in range and cancels in the normalization
+    weights = np.exp(eta * (counts - counts.max(axis=-1)[..., np.newaxis]))
+    return weights / np.sum(weights, axis=-1)[..., np.newaxis]
+
+def pirate(N, eta, probs_all, trials=None):
     '''
     Pirate by listening `N` times. `eta` is the multiplicative weights update parameter.
-    ''' 
-    weights = np.ones(num_songs)
-    probs = weights / np.sum(weights)
-    for _ in range(int(N)):
-        song = pick_song(probs_all)
-        weights[song] *= np.exp(eta)
-        probs = weights / np.sum(weights)
-    return KL_divergence(probs_all, probs)
+    The final weights only depend on how often each song was heard, so the counts are one
+    multinomial draw. Returns one divergence, or an array of `trials` divergences.
+    '''
+    counts = random.multinomial(int(N), probs_all, size=trials)
+    return KL_divergence(probs_all, estimate(counts, eta))
+
+def pirate_curve(Ns, eta, probs_all, trials):
+    '''
+    Pirate by listening up to max(`Ns`) times in each of `trials` streams, and return the
+    (len(Ns), trials) array of divergences after the first `N` listens of each stream.
+    '''
+    Ns = np.array(Ns, dtype=int)
+    order = np.argsort(Ns)
+    counts = np.zeros((trials, len(probs_all)), dtype=int)
+    divs = np.empty((len(Ns), trials))
+    heard = 0
+    for index in order:
+        # only the listens since the previous N are drawn
+        counts += random.multinomial(Ns[index] - heard, probs_all, size=trials)
+        heard = Ns[index]
+        divs[index] = KL_divergence(probs_all, estimate(counts, eta))
+    return divs
 
 ################
 ### Plotting ###
@@ -48,7 +66,7 @@ fig.subplots_adjust(right=0.85)
 
 for epsilon in (0.1, 1, 10, 100):
 
-    num_intended = frac * num_songs
+    num_intended = int(frac * num_songs)
     num_unintended = num_songs - num_intended
     utilities = (random.random(size=num_intended))**power # sensitivity assumed 1
 
@@ -64,25 +82,10 @@ for epsilon in (0.1, 1, 10, 100):
 
     print "Probability a given picked song is intended: ", prob_intended
 
-    # setup toolbar
-    toolbar_width = num_Ns
-    sys.stdout.write("[%s]" % (" " * toolbar_width))
-    sys.stdout.flush()
-    sys.stdout.write("\b" * (toolbar_width+1)) # return to start of line, after '['
-
     Ns = np.logspace(-1, upper_N_exponent, num=num_Ns)
-    div_means = []
-    div_stds = []
-
-    for N in Ns:
-        divs = []
-        for _ in range(ntrials):
-            divs.append(pirate(N, eta, probs_all))
-        div_means.append(np.mean(divs))
-        div_stds.append(np.std(divs))
-        sys.stdout.write("-")
-        sys.stdout.flush()
-
+    divs = pirate_curve(Ns, eta, probs_all, ntrials)
+    div_means = np.mean(divs, axis=1)
+    div_stds = np.std(divs, axis=1)
 
     pl.plot(Ns, div_means, lw=8, label=r"\(\varepsilon = {}\)".format(epsilon))
 
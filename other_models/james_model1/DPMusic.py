@@ -1,5 +1,5 @@
 from operator import mul
-from random import randrange
+import numpy
 
 
 # Parameters and debug
@@ -25,6 +25,48 @@ WEIGHT_BONUS = 0.1
 # Differential privacy parameter
 EPSILON = 1.0
 
+# Songs are generated and written this many at a time
+CHUNK_SIZE = 1 << 18
+
+# Text line of a song, with its weight already formatted
+LINE_FORMAT = '%s [' + ', '.join(len(INTENDED_VERSES) * ['%d']) + ']\n'
+
+
+def randomVerses(low, high, count):
+    '''Returns a count-by-verses array of songs whose i-th verse is drawn
+    uniformly from low[i] up to but not including high[i]'''
+    low = numpy.array(low)
+    return low + (numpy.random.random_sample((count, len(low))) *
+                  (numpy.array(high) - low)).astype(int)
+
+
+def intendedSongs(intendedVerses, count):
+    '''Returns a count-by-verses array of distinct songs whose i-th verse is
+    below intendedVerses[i], drawn a batch at a time'''
+    songs = []
+    seen = set()
+    while len(songs) < count:
+        for song in randomVerses(len(intendedVerses) * [0], intendedVerses,
+                                 count).tolist():
+            if len(songs) < count and tuple(song) not in seen:
+                seen.add(tuple(song))
+                songs.append(song)
+    return numpy.array(songs)
+
+
+def songWeights(songs):
+    '''Returns the weight of every song, WEIGHT_BONUS per intended verse'''
+    return WEIGHT_BONUS * (songs <= INTENDED_VERSES).sum(axis=1)
+
+
+def writeSongs(f, weights, songs):
+    '''Writes one "weight [verse, ...]" line per song to the file f'''
+    # Weights come from a handful of values, so each is formatted only once
+    values, indices = numpy.unique(weights, return_inverse=True)
+    names = [str(value) if value else '0' for value in values.tolist()]
+    f.write(''.join([LINE_FORMAT % ((names[index],) + tuple(song))
+                     for index, song in zip(indices.tolist(), songs.tolist())]))
+
 class DPMusic:
     '''Differentially private song generation, using strings for music.'''
 
@@ -50,39 +92,18 @@ class DPMusic:
 
         f = open(INPUT_FILE_NAME, 'w')
 
-        intendedSongsCount = 0
-        intendedSongs = []
         songLength = len(INTENDED_VERSES)
 
         # Get all the combinations of intended songs first
-        while intendedSongsCount < NUM_INTENDED_SONGS:
-            song = songLength * [0]
-
-            for j in range(songLength):
-                song[j] = randrange(INTENDED_VERSES[j])
-
-            if song not in intendedSongs:
-                intendedSongs.append(song)
-                intendedSongsCount += 1
-                f.write(str(WEIGHT_BONUS * songLength) + ' ' + str(song) + '\n')
-
-        for i in range(NUM_SONGS - NUM_INTENDED_SONGS):
-            song = songLength * [0]
+        songs = intendedSongs(INTENDED_VERSES, NUM_INTENDED_SONGS)
+        writeSongs(f, numpy.full(len(songs), WEIGHT_BONUS * songLength), songs)
 
-            # Generate the song and its weight
-            weight = 0
-            for verseNum in range(songLength):
-                # Randomly generate a song space
-                verse = randrange(TOTAL_VERSES[verseNum] - \
-                    INTENDED_VERSES[verseNum]) + INTENDED_VERSES[verseNum]
-                song[verseNum] = verse
+        for start in range(0, NUM_SONGS - NUM_INTENDED_SONGS, CHUNK_SIZE):
+            count = min(CHUNK_SIZE, NUM_SONGS - NUM_INTENDED_SONGS - start)
 
-                # If the this verse is intended, raise its weight
-                if verse <= INTENDED_VERSES[verseNum]:
-                    weight += WEIGHT_BONUS
-
-            # Write the song to the file
-            f.write(str(weight) + ' ' + str(song) + '\n')
+            # Generate the songs and their weights
+            songs = randomVerses(INTENDED_VERSES, TOTAL_VERSES, count)
+            writeSongs(f, songWeights(songs), songs)
 
         f.close()
 
@@ -104,29 +125,16 @@ class DPMusic:
         numNonZeroWeight = 0
         numHighWeight = 0
 
-        for i in range(NUM_SONGS):
-            song = songLength * [0]
-
-            # Generate the song and its weight
-            weight = 0
-            for verseNum in range(songLength):
-                # Randomly generate a song space
-                verse = randrange(TOTAL_VERSES[verseNum])
-                song[verseNum] = verse
-
-                # If the this verse is intended, raise its weight
-                if verse <= INTENDED_VERSES[verseNum]:
-                    weight += WEIGHT_BONUS
-
-            # Write the song to the file
-            f.write(str(weight) + ' ' + str(song) + '\n')
+        for start in range(0, NUM_SONGS, CHUNK_SIZE):
+            count = min(CHUNK_SIZE, NUM_SONGS - start)
 
-            if weight > 0.1:
-                numHighWeight += 1
-                numNonZeroWeight += 1
+            # Generate the songs and their weights
+            songs = randomVerses(songLength * [0], TOTAL_VERSES, count)
+            weights = songWeights(songs)
+            writeSongs(f, weights, songs)
 
-            elif weight > 0.0:
-                numNonZeroWeight += 1
+            numHighWeight += int((weights > 0.1).sum())
+            numNonZeroWeight += int((weights > 0.0).sum())
 
         f.close()
 
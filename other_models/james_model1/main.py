@@ -9,5 +9,7 @@ def main():
     for i in range(NUM_TRIALS):
         testclass.playSong()
 
+    testclass.close()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
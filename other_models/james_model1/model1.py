@@ -1,6 +1,12 @@
 from operator import mul
-from random import randrange, random
 from math import exp
+from collections import deque
+from DPMusic import CHUNK_SIZE, intendedSongs, randomVerses
+import mmap
+import numpy
+import os
+import struct
+import time
 
 
 # Parameters and debug
@@ -8,6 +14,8 @@ DEBUG = 1
 INTENDED_FILE_NAME = 'intended.data'
 UNINTENDED_FILE_NAME = 'unintended.data'
 PLAYED_FILE_NAME = 'played.data'
+INTENDED_STORE_NAME = 'intended.songs'
+UNINTENDED_STORE_NAME = 'unintended.songs'
 
 # Variations per feature for the exponential mechanism. Each song has a certain
 # amount of intended verses. These are part of a larger set of total verses that
@@ -31,16 +39,157 @@ WEIGHT_BONUS = 0.1
 # Differential privacy parameter
 EPSILON = 1.0
 
+# Play log buffering: plays are written once this many are buffered or this
+# many seconds have passed since the last write, and the log is rotated once it
+# grows past PLAY_LOG_MAX_BYTES (0 never rotates), keeping PLAY_LOG_BACKUPS old
+# logs. Only the last RECENT_PLAYS plays are kept in memory.
+PLAY_LOG_BUFFER_SIZE = 1000
+PLAY_LOG_FLUSH_SECONDS = 5.0
+PLAY_LOG_MAX_BYTES = 0
+PLAY_LOG_BACKUPS = 1
+RECENT_PLAYS = 1000
+
+# Song store records are a little-endian float64 weight and one byte per verse,
+# or two bytes per verse if some verse has more than 256 choices
+VERSE_BYTES = 1 if max(TOTAL_VERSES) <= 1 << 8 else 2
+assert max(TOTAL_VERSES) <= 1 << (8 * VERSE_BYTES), 'Too many verse choices'
+RECORD_FORMAT = '<d' + str(len(INTENDED_VERSES)) + {1: 'B', 2: 'H'}[VERSE_BYTES]
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+RECORD_DTYPE = numpy.dtype([('weight', '<f8'),
+                            ('verses', '<u' + str(VERSE_BYTES),
+                             (len(INTENDED_VERSES),))])
+
+# Songs are played this many at a time when streaming
+PLAY_CHUNK_SIZE = 1 << 12
+
+
+def formatSong(weight, song):
+    '''Returns the text line of a song, like "0.01 [2, 57, ...]"'''
+    return '%.12g' % weight + ' ' + str(song) + '\n'
+
+
+class PlayLog:
+    '''Append-only log of played songs, buffered so each play costs O(1).'''
+
+    def __init__(self, fileName, bufferSize=PLAY_LOG_BUFFER_SIZE,
+                 flushSeconds=PLAY_LOG_FLUSH_SECONDS, maxBytes=PLAY_LOG_MAX_BYTES,
+                 backups=PLAY_LOG_BACKUPS):
+        '''Opens the log file fileName for appending.'''
+        self.fileName = fileName
+        self.bufferSize = bufferSize
+        self.flushSeconds = flushSeconds
+        self.maxBytes = maxBytes
+        self.backups = backups
+        self.buffer = []
+        self.lastFlush = time.time()
+        self.file = open(fileName, 'a')
+
+    def write(self, line):
+        '''Buffers a line, writing the buffer out if it is full or old'''
+        self.writeLines([line])
+
+    def writeLines(self, lines):
+        '''Buffers lines, writing the buffer out if it is full or old'''
+        self.buffer.extend(lines)
+        if len(self.buffer) >= self.bufferSize or \
+                time.time() - self.lastFlush >= self.flushSeconds:
+            self.flush()
+
+    def flush(self):
+        '''Writes out the buffered lines, rotating the log if it is too big'''
+        if self.buffer:
+            self.file.write(''.join(self.buffer))
+            self.buffer = []
+        self.file.flush()
+        self.lastFlush = time.time()
+        if self.maxBytes and self.file.tell() >= self.maxBytes:
+            self.rotate()
+
+    def rotate(self):
+        '''Renames the log to fileName.1 (older logs to .2 and so on, up to
+        backups of them) and starts a new, empty log'''
+        self.file.close()
+        for number in range(self.backups - 1, 0, -1):
+            older = self.fileName + '.' + str(number)
+            if os.path.exists(older):
+                os.rename(older, self.fileName + '.' + str(number + 1))
+        if self.backups:
+            os.rename(self.fileName, self.fileName + '.1')
+        self.file = open(self.fileName, 'w')
+
+    def close(self):
+        '''Writes out the buffered lines and closes the log'''
+        self.flush()
+        self.file.close()
+
+
+class SongStore:
+    '''Fixed-width binary song records, memory-mapped so reading any song is
+    one O(1) record read. The mapping is read-only, so one store can serve
+    any number of players.'''
+
+    def __init__(self, fileName):
+        '''Maps the song store file fileName.'''
+        self.file = open(fileName, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size % RECORD_SIZE:
+            raise ValueError(fileName + ' is not a song store')
+        self.count = size // RECORD_SIZE
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else ''
+
+    def __len__(self):
+        return self.count
+
+    def song(self, index):
+        '''Returns the weight and verse list of song number index'''
+        record = struct.unpack_from(RECORD_FORMAT, self.map, index * RECORD_SIZE)
+        return record[0], list(record[1:])
+
+    def records(self):
+        '''Returns every record as a RECORD_DTYPE array viewing the mapping,
+        so indexing it with an array of indices reads only those songs'''
+        if not self.count:
+            return numpy.empty(0, RECORD_DTYPE)
+        return numpy.frombuffer(self.map, RECORD_DTYPE)
+
+    def close(self):
+        if self.count:
+            self.map.close()
+        self.file.close()
+
+    @staticmethod
+    def write(fileName, songs):
+        '''Writes an iterable of (weight, song) pairs to the song store file
+        fileName'''
+        with open(fileName, 'wb') as f:
+            for weight, song in songs:
+                f.write(struct.pack(RECORD_FORMAT, weight, *song))
+
+    @staticmethod
+    def fromTextFile(textFileName, fileName):
+        '''Writes the songs of a text file of "weight [verse, ...]" lines to
+        the song store file fileName'''
+        def songs():
+            with open(textFileName, 'r') as f:
+                for line in f:
+                    weight, song = line.split(' ', 1)
+                    yield float(weight), [int(verse) for verse in song.strip()[1:-1].split(',')]
+        SongStore.write(fileName, songs())
+
+
 class DPMusic:
     '''Differentially private song generation, using strings for music.'''
 
-    def __init__(self):
-        '''Initializes member variables.'''
+    def __init__(self, weighted=False):
+        '''Initializes member variables. If weighted, every song is drawn by
+        the exponential mechanism over its own weight, instead of a coin flip
+        between the intended and unintended songs.'''
         if DEBUG: print 'Initializing'
 
         # Destroy outputs
         f = open(PLAYED_FILE_NAME, 'w')
         f.close()
+        self.playLog = PlayLog(PLAYED_FILE_NAME)
 
         # Global sensitivity
         self.sensitivity = WEIGHT_BONUS * len(INTENDED_VERSES)
@@ -52,8 +201,17 @@ class DPMusic:
         self.pIntended = propIntended / (propIntended + propUnintended)
         self.pUnintended = propUnintended / (propIntended + propUnintended)
 
-        # Songs we have played
-        self.songsPlayed = []
+        # The most recent songs we have played
+        self.songsPlayed = deque(maxlen=RECENT_PLAYS)
+
+        # Song stores, opened on the first play
+        self.intendedStore = None
+        self.unintendedStore = None
+
+        # Cumulative exponential mechanism weights of the intended songs
+        # followed by the unintended songs, if weighted
+        self.weighted = weighted
+        self.cumulativeWeights = None
 
         if DEBUG:
             print 'Total songs: ' + str(NUM_SONGS)
@@ -64,71 +222,124 @@ class DPMusic:
         non-intended songs all have weight 0'''
         if DEBUG: print 'Writing input file...'
 
-        f = open(INTENDED_FILE_NAME, 'w')
-
-        intendedSongsCount = 0
-        intendedSongs = []
-        songLength = len(INTENDED_VERSES)
+        self.closeStores()
 
         # Get all the combinations of intended songs first
-        while intendedSongsCount < NUM_INTENDED_SONGS:
-            song = songLength * [0]
-
-            for j in range(songLength):
-                song[j] = randrange(INTENDED_VERSES[j])
-
-            if song not in intendedSongs:
-                intendedSongs.append(song)
-                intendedSongsCount += 1
-                f.write(str(INTENDED_WEIGHT) + ' ' + str(song) + '\n')
-
-        f.close()
-        f = open(UNINTENDED_FILE_NAME, 'w')
+        records = numpy.empty(NUM_INTENDED_SONGS, RECORD_DTYPE)
+        records['weight'] = INTENDED_WEIGHT
+        records['verses'] = intendedSongs(INTENDED_VERSES, NUM_INTENDED_SONGS)
+        records.tofile(INTENDED_STORE_NAME)
 
         # Randomly generate unintended songs until our space is filled
-        for i in range(NUM_UNINTENDED_SONGS):
-            song = songLength * [0]
-
-            # Generate the song
-            for verseNum in range(songLength):
-                # Randomly generate a song space
-                verse = randrange(TOTAL_VERSES[verseNum] - \
-                    INTENDED_VERSES[verseNum]) + INTENDED_VERSES[verseNum]
-                song[verseNum] = verse
-
-            # Write the song to the file
-            f.write(str(UNINTENDED_WEIGHT) + ' ' + str(song) + '\n')
-
-        f.close()
+        with open(UNINTENDED_STORE_NAME, 'wb') as f:
+            for start in range(0, NUM_UNINTENDED_SONGS, CHUNK_SIZE):
+                count = min(CHUNK_SIZE, NUM_UNINTENDED_SONGS - start)
+                records = numpy.empty(count, RECORD_DTYPE)
+                records['weight'] = UNINTENDED_WEIGHT
+                records['verses'] = randomVerses(INTENDED_VERSES, TOTAL_VERSES,
+                                                 count)
+                records.tofile(f)
 
         if DEBUG:
             print str(NUM_INTENDED_SONGS) + ' intended songs'
             print str(NUM_UNINTENDED_SONGS) + ' unintended songs'
             print str(NUM_SONGS) + ' total songs'
 
+    def openStores(self):
+        '''Maps the song stores, converting the text files of older runs if
+        there are no stores yet'''
+        for textFileName, storeName in ((INTENDED_FILE_NAME, INTENDED_STORE_NAME),
+                                        (UNINTENDED_FILE_NAME, UNINTENDED_STORE_NAME)):
+            if not os.path.exists(storeName) and os.path.exists(textFileName):
+                if DEBUG: print 'Converting ' + textFileName + ' to ' + storeName
+                SongStore.fromTextFile(textFileName, storeName)
+        self.intendedStore = SongStore(INTENDED_STORE_NAME)
+        self.unintendedStore = SongStore(UNINTENDED_STORE_NAME)
+        if self.weighted:
+            self.cumulativeWeights = self.songCumulativeWeights()
+
+    def songCumulativeWeights(self):
+        '''Returns the running sums of exp(EPSILON * weight / (2 *
+        sensitivity)) over every song in the stores, intended songs first.
+        Weights are shifted by the largest one, which keeps the exponentials
+        in range without changing the probabilities.'''
+        stores = (self.intendedStore, self.unintendedStore)
+        maxWeight = max([store.records()['weight'].max() for store in stores
+                         if len(store)])
+        cumulativeWeights = numpy.empty(sum([len(store) for store in stores]))
+        total = 0.0
+        start = 0
+        for store in stores:
+            records = store.records()
+            for chunkStart in range(0, len(records), CHUNK_SIZE):
+                weights = records['weight'][chunkStart:chunkStart + CHUNK_SIZE]
+                chunk = numpy.exp(EPSILON * (weights - maxWeight) /
+                                  (2 * self.sensitivity)).cumsum() + total
+                cumulativeWeights[start:start + len(chunk)] = chunk
+                total = chunk[-1]
+                start += len(chunk)
+        return cumulativeWeights
+
+    def closeStores(self):
+        '''Unmaps the song stores, if open'''
+        for store in (self.intendedStore, self.unintendedStore):
+            if store is not None:
+                store.close()
+        self.intendedStore = None
+        self.unintendedStore = None
+
     def playSong(self):
         '''Plays a song from the database'''
-        selector = random()
-
-        # Which song category does the selector fall under?
-        if selector <= self.pIntended:
-            f = open(INTENDED_FILE_NAME, 'r')
-            songs = f.readlines()
-            song = songs[randrange(NUM_INTENDED_SONGS)]
-            f.close()
+        song = self.playBatch(1)[0]
+
+        print 'Played: ' + str(song)
+
+    def playBatch(self, count):
+        '''Plays count songs from the database at once and returns their
+        lines'''
+        if self.intendedStore is None:
+            self.openStores()
+        intendedRecords = self.intendedStore.records()
+        unintendedRecords = self.unintendedStore.records()
+
+        if self.weighted:
+            # Invert the cumulative weights at uniformly random points
+            points = numpy.random.random_sample(count) * self.cumulativeWeights[-1]
+            indices = numpy.searchsorted(self.cumulativeWeights, points, side='right')
+            intended = indices < len(intendedRecords)
+            indices = numpy.where(intended, indices, indices - len(intendedRecords))
         else:
-            f = open(UNINTENDED_FILE_NAME, 'r')
-            songs = f.readlines()
-            song = songs[randrange(NUM_UNINTENDED_SONGS)]
-            f.close()
-
-        # Append this song
-        with open(PLAYED_FILE_NAME, 'r+') as f:
-            old = f.read()
-            f.seek(0)
-            f.write(old + str(song))
-            f.close()
-
-        self.songsPlayed.append(song)
-        
-        print 'Played: ' + str(song)
\ No newline at end of file
+            # Which song category does each selector fall under?
+            intended = numpy.random.random_sample(count) <= self.pIntended
+            indices = numpy.where(
+                intended,
+                numpy.random.randint(max(len(intendedRecords), 1), size=count),
+                numpy.random.randint(max(len(unintendedRecords), 1), size=count))
+
+        records = numpy.empty(count, RECORD_DTYPE)
+        records[intended] = intendedRecords[indices[intended]]
+        records[~intended] = unintendedRecords[indices[~intended]]
+        songs = [formatSong(weight, verses) for weight, verses in
+                 zip(records['weight'].tolist(), records['verses'].tolist())]
+
+        # Append these songs
+        self.playLog.writeLines(songs)
+
+        self.songsPlayed.extend(songs)
+
+        return songs
+
+    def streamPlays(self, chunkSize=PLAY_CHUNK_SIZE, count=None):
+        '''Yields played song lines, playing chunkSize songs at a time, until
+        count songs have been played, or forever if count is None'''
+        played = 0
+        while count is None or played < count:
+            size = chunkSize if count is None else min(chunkSize, count - played)
+            for song in self.playBatch(size):
+                yield song
+            played += size
+
+    def close(self):
+        '''Writes out the play log and unmaps the song stores'''
+        self.playLog.close()
+        self.closeStores()
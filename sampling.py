@@ -0,0 +1,108 @@
+import numpy
+import random
+
+
+class AliasTable:
+    """Walker alias table for O(1) sampling from a discrete distribution
+
+    Built with Vose's method: every column holds its own index with
+    probability ``probabilities[i]`` and ``aliases[i]`` otherwise, so a draw
+    is one uniform column pick and one biased coin flip.
+
+    :param probabilities: probabilities of every index, summing to 1
+    :ivar probabilities: acceptance probability of every column
+    :ivar aliases: alias index of every column
+    """
+
+    def __init__(self, probabilities):
+        probabilities = numpy.asarray(probabilities, dtype=float)
+        size = len(probabilities)
+        scaled = (probabilities * size / probabilities.sum()).tolist()
+        aliases = list(range(size))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            aliases[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # Leftovers are 1 up to rounding error
+        for i in small + large:
+            scaled[i] = 1.0
+        self.probabilities = numpy.array(scaled)
+        self.aliases = numpy.array(aliases, dtype=numpy.int64)
+
+    def __len__(self):
+        return len(self.probabilities)
+
+    def sample(self):
+        """Return a random index drawn from the table's distribution
+
+        :return: random index
+        :rtype: int
+        """
+        column = random.randrange(len(self.probabilities))
+        if random.random() < self.probabilities[column]:
+            return column
+        return int(self.aliases[column])
+
+    def sample_batch(self, count, random_state=None):
+        """Return an array of random indices drawn from the table's distribution
+
+        :param int count: number of indices to draw
+        :param random_state: numpy RandomState to draw from (default: numpy.random)
+        :return: array of random indices
+        :rtype: numpy.ndarray
+        """
+        random_state = numpy.random if random_state is None else random_state
+        columns = random_state.randint(len(self.probabilities), size=count)
+        accepted = random_state.random_sample(count) < self.probabilities[columns]
+        return numpy.where(accepted, columns, self.aliases[columns])
+
+
+def stacked_alias_tables(probabilities):
+    """Return the alias tables of many distributions at once
+
+    Builds Vose's tables for every row together. Each row's columns are
+    sorted by scaled probability, then one pass pairs the next small column of
+    every row with its largest column still above 1, so there are at most as
+    many vectorized passes as columns, instead of a Python loop per row.
+
+    :param probabilities: (rows, size) array of probabilities, each row summing to 1
+    :return: (rows, size) arrays of acceptance probabilities and aliases
+    :rtype: tuple
+    """
+    probabilities = numpy.atleast_2d(numpy.asarray(probabilities, dtype=float))
+    rows, size = probabilities.shape
+    scaled = probabilities * size / probabilities.sum(axis=1)[:, numpy.newaxis]
+    order = numpy.argsort(scaled, axis=1)
+    acceptances = numpy.ones((rows, size))
+    aliases = numpy.tile(numpy.arange(size, dtype=numpy.int64), (rows, 1))
+    row_indices = numpy.arange(rows)
+    # Columns order[:, :lower] are paired, order[:, upper] is the current large
+    # column, and a large column that drops below 1 becomes the pending small one
+    lower = numpy.zeros(rows, dtype=numpy.int64)
+    upper = numpy.full(rows, size - 1, dtype=numpy.int64)
+    pending = numpy.full(rows, -1, dtype=numpy.int64)
+    while True:
+        next_small = order[row_indices, numpy.minimum(lower, size - 1)]
+        has_pending = pending >= 0
+        active = numpy.where(has_pending, upper >= lower,
+                             (lower < upper) & (scaled[row_indices, next_small] < 1.0))
+        if not active.any():
+            break
+        active_rows = row_indices[active]
+        less = numpy.where(has_pending, pending, next_small)[active]
+        more = order[active_rows, upper[active]]
+        acceptances[active_rows, less] = scaled[active_rows, less]
+        aliases[active_rows, less] = more
+        scaled[active_rows, more] -= 1.0 - scaled[active_rows, less]
+        lower[active_rows] += ~has_pending[active]
+        dropped = scaled[active_rows, more] < 1.0
+        pending[active_rows] = numpy.where(dropped, more, -1)
+        upper[active_rows] -= dropped
+    # Leftovers stay at 1, up to rounding error
+    return acceptances, aliases
@@ -0,0 +1,80 @@
+import json
+import numpy
+import os
+import struct
+
+MAGIC = b'CS152SNP'
+ALIGNMENT = 64
+
+
+def write_snapshot(path, header, arrays):
+    """Write named arrays and a JSON header to a binary snapshot file
+
+    The file holds the magic bytes, the header length as a little-endian
+    uint32, the JSON header, and then every array's raw C-order bytes at a
+    64-byte aligned offset, so each array can be memory-mapped in place. The
+    file is written next to ``path`` and renamed over it, so readers never
+    see a partial snapshot.
+
+    :param str path: snapshot file path
+    :param dict header: JSON-serializable metadata
+    :param dict arrays: names keying to numpy arrays
+    """
+    header = dict(header)
+    names = sorted(arrays)
+    arrays = [numpy.ascontiguousarray(arrays[name]) for name in names]
+    # Array offsets depend on the header length, so lay out until the header fits
+    data_start = 0
+    while True:
+        header['arrays'] = []
+        position = data_start
+        for name, array in zip(names, arrays):
+            header['arrays'].append({'name': name, 'dtype': array.dtype.str,
+                                     'shape': list(array.shape), 'offset': position})
+            position = _align(position + array.nbytes)
+        header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+        header_end = len(MAGIC) + 4 + len(header_bytes)
+        if header_end <= data_start:
+            break
+        data_start = _align(header_end)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(MAGIC)
+        snapshot_file.write(struct.pack('<I', len(header_bytes)))
+        snapshot_file.write(header_bytes)
+        for entry, array in zip(header['arrays'], arrays):
+            snapshot_file.seek(entry['offset'])
+            array.tofile(snapshot_file)
+        snapshot_file.truncate(position)
+    os.rename(temporary_path, path)
+
+
+def read_snapshot(path, mmap_mode='r'):
+    """Read the JSON header and named arrays of a binary snapshot file
+
+    :param str path: snapshot file path
+    :param str mmap_mode: numpy.memmap mode ('r', 'r+', or 'c'), or None to read into memory
+    :return: header dict and dict of names keying to arrays
+    :rtype: tuple
+    """
+    with open(path, 'rb') as snapshot_file:
+        if snapshot_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a snapshot file: %s' % path)
+        header_length, = struct.unpack('<I', snapshot_file.read(4))
+        header = json.loads(snapshot_file.read(header_length).decode('utf-8'))
+        arrays = {}
+        for entry in header.pop('arrays'):
+            dtype = numpy.dtype(str(entry['dtype']))
+            shape = tuple(entry['shape'])
+            if mmap_mode is None or not numpy.prod(shape):
+                snapshot_file.seek(entry['offset'])
+                count = int(numpy.prod(shape))
+                array = numpy.fromfile(snapshot_file, dtype=dtype, count=count).reshape(shape)
+            else:
+                array = numpy.memmap(path, dtype=dtype, mode=mmap_mode, offset=entry['offset'], shape=shape)
+            arrays[str(entry['name'])] = array
+    return header, arrays
+
+
+def _align(position):
+    return -(-position // ALIGNMENT) * ALIGNMENT
@@ -1,17 +1,29 @@
 from adversary import Adversary
 from curator import Curator
 from database import Network
+from engine import ProbabilityEngine
+from experiments import load_results
 from matplotlib import pyplot
+from metrics import top_sequence_error
 import numpy as np
+import os
+import tempfile
 
 
-def kl_divergence(distribution, approx_distribution):
-    """Calculate the KL divergence for two distributions
+def top_sequences_error(curator_engine, adversary_engine, preferences, sequence_length, cutoff_number):
+    """Calculate the fraction of the curator's top sequences missing from the adversary's
 
-    :param distribution: original proabability distribution
-    :param approx_distribution: approximate of the original distribution
+    :param curator_engine: ProbabilityEngine of the curator's network
+    :param adversary_engine: ProbabilityEngine of the adversary's network
+    :param tuple preferences: user input at each node
+    :param int sequence_length: length of sequences
+    :param int cutoff_number: number of top sequences to compare
     """
-    return tuple(np.sum(distribution) * np.log(np.array(distribution) / np.array(approx_distribution)))
+    curator_top_sequences = [sequence for sequence, _ in
+                             curator_engine.top_sequences(preferences, sequence_length, cutoff_number)]
+    adversary_top_sequences = [sequence for sequence, _ in
+                               adversary_engine.top_sequences(preferences, sequence_length, cutoff_number)]
+    return top_sequence_error(curator_top_sequences, adversary_top_sequences)
 
 
 def test_adversary():
@@ -29,6 +41,8 @@ def test_adversary():
     curator.network = Network(size, interactivity)
     curator.network.make_random_links()
     adversary = Adversary(curator)
+    curator_engine = ProbabilityEngine(curator.network, curator.exponential_mechanism)
+    adversary_engine = ProbabilityEngine(adversary.network, Adversary.normalize)
     preferences = tuple(curator.network.get_random_preferences() for _ in range(preference_count))
 
     errors = {cutoff_fraction: {preference: [] for preference in preferences}
@@ -39,20 +53,15 @@ def test_adversary():
         adversary.pirate(sequence_length, number_of_queries=int(query_count))
         for preference in preferences:
             print 'Preference %d' % (preferences.index(preference) + 1)
-            adversary_probabilities = adversary.network.sequence_probabilities(preference,
-                                                                               sequence_length,
-                                                                               Adversary.normalize)
-            curator_probabilities = curator.network.sequence_probabilities(preference,
-                                                                           sequence_length,
-                                                                           curator.exponential_mechanism)
             for cutoff_fraction in cutoff_fractions:
-                cutoff_number = int(cutoff_fraction * len(curator_probabilities))
-                error_count = (sum(adversary_probabilities[i] not in sorted(adversary_probabilities)[:cutoff_number]
-                               for i in range(len(curator_probabilities[:cutoff_number]))))
-                errors[cutoff_fraction][preference].append(1.0 * error_count / cutoff_number)
+                cutoff_number = int(cutoff_fraction * size ** sequence_length)
+                errors[cutoff_fraction][preference].append(top_sequences_error(curator_engine, adversary_engine,
+                                                                               preference, sequence_length,
+                                                                               cutoff_number))
 
             # KL Divergence after a preference query
-            kl_divergences[preference].append(kl_divergence(curator_probabilities, adversary_probabilities))
+            kl_divergences[preference].append(adversary_engine.kl_divergence(curator_engine, preference,
+                                                                             sequence_length))
 
     figure, (axes_error, axes_kl) = pyplot.subplots(1, 2)
     figure.canvas.set_window_title('Top Sequences Error and KL Divergence vs. Number of Queries')
@@ -91,6 +100,8 @@ def test_adversary_no_kl():
     curator.network = Network(size, interactivity)
     curator.network.make_random_links()
     adversary = Adversary(curator)
+    curator_engine = ProbabilityEngine(curator.network, curator.exponential_mechanism)
+    adversary_engine = ProbabilityEngine(adversary.network, Adversary.normalize)
     preferences = tuple(curator.network.get_random_preferences() for _ in range(preference_count))
 
     errors = {cutoff_fraction: {preference: [] for preference in preferences}
@@ -100,18 +111,11 @@ def test_adversary_no_kl():
         adversary.pirate(sequence_length, number_of_queries=int(query_count))
         for preference in preferences:
             print 'Preference %d' % (preferences.index(preference) + 1)
-            adversary_probabilities = adversary.network.sequence_probabilities(preference,
-                                                                               sequence_length,
-                                                                               Adversary.normalize)
-            curator_probabilities = curator.network.sequence_probabilities(preference,
-                                                                           sequence_length,
-                                                                           curator.exponential_mechanism)
             for cutoff_fraction in cutoff_fractions:
-                cutoff_number = int(cutoff_fraction * len(curator_probabilities))
-                sorted_adversary_probabilities = sorted(adversary_probabilities)
-                error_count = (sum(adversary_probabilities[i] not in sorted_adversary_probabilities[:cutoff_number]
-                               for i in range(len(curator_probabilities[:cutoff_number]))))
-                errors[cutoff_fraction][preference].append(1.0 * error_count / cutoff_number)
+                cutoff_number = int(cutoff_fraction * size ** sequence_length)
+                errors[cutoff_fraction][preference].append(top_sequences_error(curator_engine, adversary_engine,
+                                                                               preference, sequence_length,
+                                                                               cutoff_number))
 
     figure, axes_error = pyplot.subplots()
     figure.canvas.set_window_title('Top Sequences Error and KL Divergence vs. Number of Queries')
@@ -144,6 +148,9 @@ def test_etas():
     curator.network = Network(size, interactivity)
     curator.network.make_random_links()
     adversaries = [Adversary(curator, eta=eta) for eta in etas]
+    curator_engine = ProbabilityEngine(curator.network, curator.exponential_mechanism)
+    adversary_engines = {adversary: ProbabilityEngine(adversary.network, Adversary.normalize)
+                         for adversary in adversaries}
     preferences = tuple(curator.network.get_random_preferences() for _ in range(preference_count))
 
     errors = {adversary: {cutoff_fraction: {preference: [] for preference in preferences}
@@ -157,20 +164,15 @@ def test_etas():
             adversary.pirate(sequence_length, number_of_queries=int(query_count))
             for preference in preferences:
                 print 'Preference %d' % (preferences.index(preference) + 1)
-                adversary_probabilities = adversary.network.sequence_probabilities(preference,
-                                                                                   sequence_length,
-                                                                                   Adversary.normalize)
-                curator_probabilities = curator.network.sequence_probabilities(preference,
-                                                                               sequence_length,
-                                                                               curator.exponential_mechanism)
                 for cutoff_fraction in cutoff_fractions:
-                    cutoff_number = int(cutoff_fraction * len(curator_probabilities))
-                    error_count = (sum(adversary_probabilities[i] not in sorted(adversary_probabilities)[:cutoff_number]
-                                   for i in range(len(curator_probabilities[:cutoff_number]))))
-                    errors[adversary][cutoff_fraction][preference].append(1.0 * error_count / cutoff_number)
+                    cutoff_number = int(cutoff_fraction * size ** sequence_length)
+                    errors[adversary][cutoff_fraction][preference].append(
+                        top_sequences_error(curator_engine, adversary_engines[adversary], preference,
+                                            sequence_length, cutoff_number))
 
                 # KL Divergence after a preference query
-                kl_divergences[adversary][preference].append(kl_divergence(curator_probabilities, adversary_probabilities))
+                kl_divergences[adversary][preference].append(
+                    adversary_engines[adversary].kl_divergence(curator_engine, preference, sequence_length))
 
     figure, (axes_error, axes_kl) = pyplot.subplots(1, 2)
     figure.canvas.set_window_title('Top Sequences Error and KL Divergence vs. Number of Queries')
@@ -263,6 +265,50 @@ def test_network():
     pyplot.show()
 
 
+def test_snapshot_round_trips():
+    storages = ('object', 'dense', 'sparse')
+    directory = tempfile.mkdtemp()
+    for saved_storage in storages:
+        network = Network(size=8, interactivity=2, storage=saved_storage)
+        network.make_random_links(density=0.3)
+        path = os.path.join(directory, saved_storage + '.snp')
+        network.save(path)
+        utilities, defined = network.utility_arrays()
+        for load_storage in storages:
+            # Object and dense snapshots hold dense arrays, so only sparse ones load as sparse
+            if (load_storage == 'sparse') != (saved_storage == 'sparse') and load_storage != 'object':
+                try:
+                    Network.load(path, storage=load_storage)
+                except ValueError:
+                    continue
+                raise AssertionError('Loaded a %s snapshot as %s' % (saved_storage, load_storage))
+            loaded = Network.load(path, storage=load_storage)
+            loaded_utilities, loaded_defined = loaded.utility_arrays()
+            assert loaded.storage == load_storage
+            assert [node.name for node in loaded.nodes] == [node.name for node in network.nodes]
+            assert np.array_equal(loaded_defined, defined)
+            assert np.array_equal(loaded_utilities[defined], utilities[defined])
+            print 'Loaded a %s snapshot as %s' % (saved_storage, load_storage)
+
+
+def plot_sweep(path, variable_name, result_name='kl_divergence'):
+    """Plot the mean and spread of a sweep result against one swept parameter
+
+    :param str path: results CSV file written by experiments.run_sweep
+    :param str variable_name: swept parameter on the x axis
+    :param str result_name: result on the y axis
+    """
+    results = load_results(path)
+    variables = np.unique(results[variable_name])
+    values = [results[result_name][results[variable_name] == variable] for variable in variables]
+    figure, axes = pyplot.subplots()
+    figure.canvas.set_window_title(result_name + ' vs. ' + variable_name)
+    axes.set_xlabel(variable_name)
+    axes.set_ylabel(result_name)
+    axes.errorbar(variables, [np.mean(value) for value in values], yerr=[np.std(value) for value in values], lw=3)
+    pyplot.show()
+
+
 if __name__ == '__main__':
     # test_adversary()
     test_adversary_no_kl()